@@ -0,0 +1,110 @@
+"""Local stand-in for the Razorpay Orders API.
+
+Run it next to the backend for development, tests and load benchmarks:
+
+    uvicorn fake_razorpay:app --port 8765
+    RAZORPAY_API_BASE_URL=http://127.0.0.1:8765/v1 uvicorn server:app
+
+Latency and failures can be injected to exercise the gateway's timeouts,
+retries and circuit breaker:
+
+    FAKE_RAZORPAY_LATENCY_MS=250      fixed delay added to every API call
+    FAKE_RAZORPAY_JITTER_MS=100       extra random delay up to this value
+    FAKE_RAZORPAY_FAILURE_RATE=0.2    fraction of calls answered with 503
+
+POST /_fake/orders/{order_id}/pay simulates a completed checkout and returns
+the payment id and signature the frontend would send to verify-payment,
+signed with RAZORPAY_KEY_SECRET just like the real gateway.
+"""
+from fastapi import FastAPI, HTTPException, Request, Depends
+from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from dotenv import load_dotenv
+from pathlib import Path
+from datetime import datetime, timezone
+from typing import Dict, Any
+import asyncio
+import hashlib
+import hmac
+import os
+import random
+import secrets
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+KEY_ID = os.environ.get("RAZORPAY_KEY_ID", "")
+KEY_SECRET = os.environ.get("RAZORPAY_KEY_SECRET", "")
+LATENCY_MS = float(os.environ.get("FAKE_RAZORPAY_LATENCY_MS", 0))
+JITTER_MS = float(os.environ.get("FAKE_RAZORPAY_JITTER_MS", 0))
+FAILURE_RATE = float(os.environ.get("FAKE_RAZORPAY_FAILURE_RATE", 0))
+
+app = FastAPI(title="Fake Razorpay")
+basic_auth = HTTPBasic()
+orders: Dict[str, Dict[str, Any]] = {}
+
+
+async def simulate_network():
+    delay_ms = LATENCY_MS + random.uniform(0, JITTER_MS)
+    if delay_ms:
+        await asyncio.sleep(delay_ms / 1000)
+    if FAILURE_RATE and random.random() < FAILURE_RATE:
+        raise HTTPException(status_code=503, detail="Injected failure")
+
+
+def check_credentials(credentials: HTTPBasicCredentials = Depends(basic_auth)):
+    # Empty configured keys accept anything, which keeps local setups simple.
+    if KEY_ID and not secrets.compare_digest(credentials.username, KEY_ID):
+        raise HTTPException(status_code=401, detail="Authentication failed")
+    if KEY_SECRET and not secrets.compare_digest(credentials.password, KEY_SECRET):
+        raise HTTPException(status_code=401, detail="Authentication failed")
+
+
+@app.post("/v1/orders", dependencies=[Depends(check_credentials)])
+async def create_order(request: Request):
+    await simulate_network()
+    payload = await request.json()
+    amount = payload.get("amount")
+    if not isinstance(amount, int) or amount < 100:
+        raise HTTPException(status_code=400, detail="The amount must be atleast INR 1.00")
+    order = {
+        "id": f"order_{secrets.token_hex(7)}",
+        "entity": "order",
+        "amount": amount,
+        "amount_paid": 0,
+        "amount_due": amount,
+        "currency": payload.get("currency", "INR"),
+        "receipt": payload.get("receipt"),
+        "status": "created",
+        "attempts": 0,
+        "created_at": int(datetime.now(timezone.utc).timestamp()),
+    }
+    orders[order["id"]] = order
+    return order
+
+
+@app.get("/v1/orders/{order_id}", dependencies=[Depends(check_credentials)])
+async def get_order(order_id: str):
+    await simulate_network()
+    order = orders.get(order_id)
+    if not order:
+        raise HTTPException(status_code=400, detail="The id provided does not exist")
+    return order
+
+
+@app.post("/_fake/orders/{order_id}/pay")
+async def pay_order(order_id: str):
+    order = orders.get(order_id)
+    if not order:
+        raise HTTPException(status_code=404, detail="Unknown order")
+    payment_id = f"pay_{secrets.token_hex(7)}"
+    signature = hmac.new(
+        KEY_SECRET.encode("utf-8"),
+        f"{order_id}|{payment_id}".encode("utf-8"),
+        hashlib.sha256
+    ).hexdigest()
+    order.update({"status": "paid", "amount_paid": order["amount"], "amount_due": 0})
+    return {
+        "razorpay_order_id": order_id,
+        "razorpay_payment_id": payment_id,
+        "razorpay_signature": signature,
+    }
@@ -1,14 +1,23 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Request, BackgroundTasks, UploadFile, File
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Request, Response, BackgroundTasks, Query, Header
+from fastapi.encoders import jsonable_encoder
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import FileResponse, JSONResponse
+from starlette.datastructures import Headers
+from starlette.staticfiles import NotModifiedResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
 import os
 import logging
+import asyncio
+import socket
+import time
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Union
 import uuid
 from datetime import datetime, timezone, timedelta
 import jwt
@@ -19,11 +28,23 @@ from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import json
 import re
+import math
+import base64
+import random
+import io
+import bisect
 import hashlib
+import gzip
 import mimetypes
-import urllib.request
-import urllib.error
+import tempfile
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from urllib.parse import urlparse
+import anyio
+import httpx
+from python_multipart.multipart import MultipartParser, parse_options_header
+from PIL import Image, ImageOps, features as pil_features
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -38,8 +59,28 @@ JWT_SECRET = os.environ.get('JWT_SECRET', 'default_secret_key')
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_HOURS = 24
 PASSWORD_RESET_EXPIRATION_HOURS = 1
-
-# Razorpay client
+# Opt-in: short-lived access tokens carrying the user's claims plus refresh
+# tokens, so authenticated requests need no user lookup.
+STATELESS_AUTH_ENABLED = os.environ.get("STATELESS_AUTH_ENABLED", "false").lower() == "true"
+ACCESS_TOKEN_EXPIRATION_MINUTES = int(os.environ.get("ACCESS_TOKEN_EXPIRATION_MINUTES", 15))
+REFRESH_TOKEN_EXPIRATION_DAYS = int(os.environ.get("REFRESH_TOKEN_EXPIRATION_DAYS", 30))
+# How often each worker pulls token revocations made by other workers.
+TOKEN_VERSION_SYNC_SECONDS = float(os.environ.get("TOKEN_VERSION_SYNC_SECONDS", 10))
+
+# Password hashing: bcrypt cost, worker threads and how many calls may queue
+# before new ones are turned away with 503.
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", 12))
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", min(4, os.cpu_count() or 1)))
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get("PASSWORD_HASH_MAX_PENDING", 32))
+
+# Authenticated principals are cached per process; TTL bounds staleness across workers.
+USER_CACHE_TTL_SECONDS = float(os.environ.get("USER_CACHE_TTL_SECONDS", 60))
+USER_CACHE_MAX_ENTRIES = int(os.environ.get("USER_CACHE_MAX_ENTRIES", 10000))
+TOKEN_CACHE_TTL_SECONDS = float(os.environ.get("TOKEN_CACHE_TTL_SECONDS", 300))
+TOKEN_CACHE_MAX_ENTRIES = int(os.environ.get("TOKEN_CACHE_MAX_ENTRIES", 10000))
+
+# Razorpay client, used only for local signature verification; API calls go
+# through the async payment_gateway.
 razorpay_client = razorpay.Client(
     auth=(os.environ.get('RAZORPAY_KEY_ID', ''), os.environ.get('RAZORPAY_KEY_SECRET', ''))
 )
@@ -57,11 +98,15 @@ logger = logging.getLogger(__name__)
 # Frontend URL for links in transactional emails
 FRONTEND_URL = os.environ.get("FRONTEND_URL", "http://localhost:3000")
 MAX_PRODUCT_IMAGE_BYTES = int(os.environ.get("MAX_PRODUCT_IMAGE_BYTES", 5 * 1024 * 1024))
+# Room for multipart boundaries and part headers around the image itself.
+MAX_UPLOAD_REQUEST_OVERHEAD_BYTES = 64 * 1024
 UPLOADS_DIR = ROOT_DIR / "uploads"
 PRODUCT_UPLOADS_DIR = UPLOADS_DIR / "products"
 SITE_UPLOADS_DIR = UPLOADS_DIR / "site"
+DERIVED_UPLOADS_DIR = PRODUCT_UPLOADS_DIR / "derived"
 PRODUCT_UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
 SITE_UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
+DERIVED_UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
 ALLOWED_PRODUCT_IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".avif"}
 REMOTE_IMAGE_PATTERN = re.compile(r"^https?://", re.IGNORECASE)
 REMOTE_IMAGE_LOCAL_MAP: Dict[str, str] = {
@@ -71,6 +116,37 @@ REMOTE_IMAGE_LOCAL_MAP: Dict[str, str] = {
     "https://images.unsplash.com/photo-1693667660388-7cccf194fc06?w=800": "/uploads/products/moong-sr25.jpg",
     "https://images.unsplash.com/photo-1731970820339-e725b78f55e4?w=800": "/uploads/products/fenugreek-sr30.jpg",
 }
+# Images shipped with the repo for the seed catalogue; the uploads GC always keeps them.
+SEED_PRODUCT_IMAGE_URLS = {
+    "/uploads/products/chickpea-sr1.jpg",
+    "/uploads/products/mustard-sr19.jpg",
+    "/uploads/products/sr-23.jpeg",
+    "/uploads/products/moong-sr25.jpg",
+    "/uploads/products/fenugreek-sr30.jpg",
+    "/uploads/products/sr-51.jpeg",
+    "/uploads/products/sr-31.jpeg",
+}
+IMAGE_DOWNLOAD_TIMEOUT_SECONDS = float(os.environ.get("IMAGE_DOWNLOAD_TIMEOUT_SECONDS", 45))
+IMAGE_DOWNLOAD_CONCURRENCY = int(os.environ.get("IMAGE_DOWNLOAD_CONCURRENCY", 8))
+IMAGE_DOWNLOAD_PER_HOST_LIMIT = int(os.environ.get("IMAGE_DOWNLOAD_PER_HOST_LIMIT", 2))
+IMAGE_DERIVATIVE_WIDTHS = [
+    int(width) for width in os.environ.get("IMAGE_DERIVATIVE_WIDTHS", "320,640,1024").split(",") if width.strip()
+]
+IMAGE_DERIVATIVE_FORMATS = [
+    image_format for image_format in os.environ.get("IMAGE_DERIVATIVE_FORMATS", "webp,avif").lower().split(",")
+    if image_format.strip() and pil_features.check(image_format.strip())
+]
+IMAGE_DERIVATIVE_QUALITY = int(os.environ.get("IMAGE_DERIVATIVE_QUALITY", 80))
+# libavif's default speed is several times slower for a barely smaller file.
+IMAGE_FORMAT_SAVE_OPTIONS: Dict[str, Dict[str, Any]] = {"avif": {"speed": 8}}
+# Inline blurred preview: a few hundred bytes of base64, embedded in list responses.
+IMAGE_PLACEHOLDER_WIDTH = int(os.environ.get("IMAGE_PLACEHOLDER_WIDTH", 16))
+IMAGE_PLACEHOLDER_FORMAT = "webp" if pil_features.check("webp") else "jpeg"
+IMAGE_PROCESS_WORKERS = int(os.environ.get("IMAGE_PROCESS_WORKERS", 2))
+# Animated GIFs would lose their animation, so they are served as uploaded.
+DERIVABLE_IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".avif"}
+# 0 disables the periodic rescan; uploads made through the API are tracked either way.
+UPLOADS_MANIFEST_REFRESH_SECONDS = int(os.environ.get("UPLOADS_MANIFEST_REFRESH_SECONDS", 0))
 LEGACY_REMOTE_LOGO_URL = "https://019c6f48-94c7-7a6c-843e-4138d52fc944.mochausercontent.com/ifslogop.png"
 DEFAULT_EMAIL_LOGO_URL = os.environ.get(
     "EMAIL_LOGO_URL",
@@ -433,6 +509,10 @@ class User(UserBase):
 class UserResponse(BaseModel):
     user: User
     token: str
+    refresh_token: Optional[str] = None
+
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
 
 class ProductVariant(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -453,15 +533,32 @@ class ProductCreate(BaseModel):
     variants: List[ProductVariant] = []
     is_active: bool = True
 
+class ImageMeta(BaseModel):
+    width: int
+    height: int
+    dominant_color: str
+    # data: URI of a tiny blurred copy, shown while the real image loads
+    placeholder: str
+
 class Product(ProductCreate):
     id: str
+    # {format: {width: url}} of resized copies of `image`, e.g. {"webp": {"320": "/uploads/..."}}
+    image_srcset: Dict[str, Dict[str, str]] = {}
+    image_meta: Optional[ImageMeta] = None
+    min_price: Optional[float] = None
+    discount_percent: Optional[float] = None
     created_at: str
     updated_at: str
 
+class ProductPage(BaseModel):
+    items: List[Dict[str, Any]]
+    next_cursor: Optional[str] = None
+    facets: Optional[List[Dict[str, Any]]] = None
+
 class CartItem(BaseModel):
     product_id: str
     variant_id: str
-    quantity: int
+    quantity: int = Field(gt=0)
 
 class AddressInfo(BaseModel):
     name: str
@@ -484,7 +581,7 @@ class OrderItem(BaseModel):
     variant_name: str
     weight: str
     price: float
-    quantity: int
+    quantity: int = Field(gt=0)
 
 class Order(BaseModel):
     id: str
@@ -499,13 +596,38 @@ class Order(BaseModel):
     payment_status: str = "pending"
     payment_id: Optional[str] = None
     razorpay_order_id: Optional[str] = None
+    # Set from refund.processed webhooks.
+    refunded_amount: Optional[float] = None
     order_status: str = "pending"
     courier_name: Optional[str] = None
     tracking_id: Optional[str] = None
     shipped_at: Optional[str] = None
+    # "reserved" at checkout, then "committed" once paid or "released" if
+    # unpaid/cancelled; None for orders placed before reservations existed.
+    stock_status: Optional[str] = None
+    reservation_expires_at: Optional[str] = None
     created_at: str
     updated_at: str
 
+class OrderSummaryItem(BaseModel):
+    product_name: str
+    weight: str
+    price: float
+    quantity: int
+
+class OrderSummary(BaseModel):
+    """List-view order: no address, payment references or stock bookkeeping."""
+    id: str
+    items: List[OrderSummaryItem]
+    total: float
+    payment_status: str = "pending"
+    order_status: str = "pending"
+    created_at: str
+
+class OrderSummaryPage(BaseModel):
+    items: List[OrderSummary]
+    next_cursor: Optional[str] = None
+
 class OrderStatusUpdate(BaseModel):
     status: str
     courier_name: Optional[str] = None
@@ -567,19 +689,163 @@ class AdminCustomerUpdate(BaseModel):
 # ============== HELPERS ==============
 
 def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(BCRYPT_ROUNDS)).decode('utf-8')
 
 def verify_password(password: str, hashed: str) -> bool:
     return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
 
-def create_token(user_id: str, role: str) -> str:
+def password_needs_rehash(hashed: str) -> bool:
+    # bcrypt hashes look like "$2b$12$<salt+digest>"; the middle field is the cost.
+    try:
+        return int(hashed.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
+
+class PasswordHasher:
+    """Runs bcrypt on a dedicated thread pool with a bounded queue.
+
+    bcrypt releases the GIL, so hashing here keeps the event loop free; once
+    max_pending calls are in flight new ones fail fast with 503 instead of
+    piling up behind a login burst.
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    async def _run(self, func, *args):
+        if self.pending >= self.max_pending:
+            raise HTTPException(
+                status_code=503,
+                detail="Server is busy, please try again shortly",
+                headers={"Retry-After": "1"}
+            )
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), func, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._run(verify_password, password, hashed)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING)
+
+async def rehash_password_if_needed(user_id: str, password: str, hashed: str):
+    """Upgrade a stored hash to the current BCRYPT_ROUNDS after a successful login."""
+    if not password_needs_rehash(hashed):
+        return
+    try:
+        new_hash = await password_hasher.hash(password)
+    except HTTPException:
+        # Saturated; the next login will try again.
+        return
+    await db.users.update_one({"id": user_id, "password": hashed}, {"$set": {"password": new_hash}})
+
+def create_token(user_id: str, role: str, token_version: int = 0) -> str:
     payload = {
         "user_id": user_id,
         "role": role,
+        "tv": token_version,
         "exp": datetime.now(timezone.utc) + timedelta(hours=JWT_EXPIRATION_HOURS)
     }
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
+# User fields embedded in stateless access tokens; together they form the principal.
+ACCESS_TOKEN_USER_CLAIMS = ("email", "name", "phone", "role", "created_at")
+
+def create_access_token(user: Dict[str, Any]) -> str:
+    payload = {
+        "typ": "access",
+        "user_id": user["id"],
+        **{claim: user.get(claim) for claim in ACCESS_TOKEN_USER_CLAIMS},
+        "tv": user.get("token_version", 0),
+        "exp": datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRATION_MINUTES)
+    }
+    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+
+def create_refresh_token(user: Dict[str, Any]) -> str:
+    payload = {
+        "typ": "refresh",
+        "user_id": user["id"],
+        "tv": user.get("token_version", 0),
+        "jti": uuid.uuid4().hex,
+        "exp": datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_EXPIRATION_DAYS)
+    }
+    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+
+def issue_auth_tokens(user: Dict[str, Any]) -> tuple[str, Optional[str]]:
+    """Return (token, refresh_token) for a freshly authenticated user."""
+    if STATELESS_AUTH_ENABLED:
+        return create_access_token(user), create_refresh_token(user)
+    return create_token(user["id"], user["role"], user.get("token_version", 0)), None
+
+class TokenVersionMap:
+    """Per-user token versions used to revoke issued tokens without a lookup.
+
+    A token whose "tv" claim is below its user's current version is rejected.
+    Only users who ever revoked their sessions are tracked, so the map stays
+    small; sync() pulls recent changes from Mongo so revocations made by other
+    workers take effect within TOKEN_VERSION_SYNC_SECONDS.
+    """
+
+    # Re-read a little history on each sync to tolerate clock skew between workers.
+    SYNC_OVERLAP_SECONDS = 60
+
+    def __init__(self):
+        self._versions: Dict[str, int] = {}
+        self._synced_at: Optional[datetime] = None
+
+    def get(self, user_id: str) -> int:
+        return self._versions.get(user_id, 0)
+
+    def set(self, user_id: str, version: int):
+        if version > self._versions.get(user_id, 0):
+            self._versions[user_id] = version
+
+    async def sync(self):
+        started_at = datetime.now(timezone.utc)
+        if self._synced_at is None:
+            query: Dict[str, Any] = {"token_version": {"$gt": 0}}
+        else:
+            cutoff = self._synced_at - timedelta(seconds=self.SYNC_OVERLAP_SECONDS)
+            query = {"token_version_updated_at": {"$gte": cutoff.isoformat()}}
+        async for user in db.users.find(query, {"_id": 0, "id": 1, "token_version": 1}):
+            self.set(user["id"], user.get("token_version", 0))
+        self._synced_at = started_at
+
+token_versions = TokenVersionMap()
+
+async def revoke_user_tokens(user_id: str):
+    """Invalidate every access and refresh token issued to a user so far."""
+    user = await db.users.find_one_and_update(
+        {"id": user_id},
+        {
+            "$inc": {"token_version": 1},
+            "$set": {"token_version_updated_at": datetime.now(timezone.utc).isoformat()}
+        },
+        projection={"token_version": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if user:
+        token_versions.set(user_id, user["token_version"])
+    invalidate_user_principal(user_id)
+
 def create_password_reset_token(user_id: str, email: str) -> str:
     payload = {
         "user_id": user_id,
@@ -600,17 +866,95 @@ def decode_password_reset_token(token: str) -> Dict[str, Any]:
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=400, detail="Invalid reset token")
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+class TTLCache:
+    """Small LRU cache whose entries also expire after a TTL.
+
+    invalidate() bumps a generation counter; set() with the generation read
+    before a slow lookup drops the value if an invalidation happened meanwhile,
+    so a stale read can't repopulate the cache.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.generation = 0
+        self._entries: "OrderedDict[str, tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: str) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None, generation: Optional[int] = None):
+        if generation is not None and generation != self.generation:
+            return
+        ttl = self.ttl_seconds if ttl_seconds is None else min(ttl_seconds, self.ttl_seconds)
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: str):
+        self.generation += 1
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self.generation += 1
+        self._entries.clear()
+
+user_principal_cache = TTLCache(USER_CACHE_MAX_ENTRIES, USER_CACHE_TTL_SECONDS)
+decoded_token_cache = TTLCache(TOKEN_CACHE_MAX_ENTRIES, TOKEN_CACHE_TTL_SECONDS)
+
+def decode_access_token(token: str) -> Dict[str, Any]:
+    payload = decoded_token_cache.get(token)
+    if payload is not None:
+        return payload
     try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        user = await db.users.find_one({"id": payload["user_id"]}, {"_id": 0, "password": 0})
-        if not user:
-            raise HTTPException(status_code=401, detail="User not found")
-        return user
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
+    # Never serve a memoized payload past the token's own expiry.
+    decoded_token_cache.set(token, payload, ttl_seconds=payload["exp"] - time.time())
+    return payload
+
+async def load_user_principal(user_id: str) -> Optional[Dict[str, Any]]:
+    user = user_principal_cache.get(user_id)
+    if user is not None:
+        return user
+    generation = user_principal_cache.generation
+    user = await db.users.find_one({"id": user_id}, {"_id": 0, "password": 0})
+    if user:
+        user_principal_cache.set(user_id, user, generation=generation)
+    return user
+
+def invalidate_user_principal(user_id: str):
+    """Call after changing a user's profile, role or password."""
+    user_principal_cache.invalidate(user_id)
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+    payload = decode_access_token(credentials.credentials)
+    if payload.get("typ") == "refresh":
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if payload.get("tv", 0) < token_versions.get(payload["user_id"]):
+        raise HTTPException(status_code=401, detail="Token revoked")
+    if payload.get("typ") == "access":
+        # Self-contained token: the claims are the principal, no database read.
+        return {"id": payload["user_id"], **{claim: payload.get(claim) for claim in ACCESS_TOKEN_USER_CLAIMS}}
+    user = await load_user_principal(payload["user_id"])
+    if not user:
+        raise HTTPException(status_code=401, detail="User not found")
+    # Handlers may mutate the principal; keep the cached copy pristine.
+    return dict(user)
 
 async def get_admin_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
     user = await get_current_user(credentials)
@@ -682,6 +1026,44 @@ async def send_templated_email(to_email: str, template_key: str, variables: Dict
     html_body = apply_email_variables(template["html_body"], variables)
     await send_email(to_email, subject, html_body)
 
+class UploadsManifest:
+    """Relative paths of every file under UPLOADS_DIR.
+
+    Image URL resolution checks this set instead of stat-ing the disk. It is
+    scanned at startup (and periodically if UPLOADS_MANIFEST_REFRESH_SECONDS
+    is set) and updated directly by the upload and localization endpoints.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self._paths: set[str] = set()
+
+    def scan(self) -> bool:
+        paths = set()
+        for dirpath, _, filenames in os.walk(self.root):
+            relative_dir = Path(dirpath).relative_to(self.root)
+            for filename in filenames:
+                if filename.startswith("."):
+                    # In-flight temp files and quarantined leftovers are never served.
+                    continue
+                paths.add((relative_dir / filename).as_posix())
+        changed = paths != self._paths
+        self._paths = paths
+        return changed
+
+    def add_url(self, local_image_url: str):
+        self._paths.add(local_image_url.removeprefix("/uploads/"))
+
+    def discard_url(self, local_image_url: str):
+        self._paths.discard(local_image_url.removeprefix("/uploads/"))
+
+    def contains_url(self, local_image_url: str) -> bool:
+        if not local_image_url.startswith("/uploads/"):
+            return False
+        return local_image_url.removeprefix("/uploads/") in self._paths
+
+uploads_manifest = UploadsManifest(UPLOADS_DIR)
+
 def local_image_url_to_file_path(local_image_url: str) -> Optional[Path]:
     if not local_image_url.startswith("/uploads/"):
         return None
@@ -694,10 +1076,7 @@ def get_local_image_if_available(image_url: str) -> str:
     if image_url.startswith("/uploads/"):
         return image_url
     mapped_local = REMOTE_IMAGE_LOCAL_MAP.get(image_url)
-    if not mapped_local:
-        return image_url
-    local_path = local_image_url_to_file_path(mapped_local)
-    if local_path and local_path.exists():
+    if mapped_local and uploads_manifest.contains_url(mapped_local):
         return mapped_local
     return image_url
 
@@ -726,57 +1105,1371 @@ def infer_image_extension(image_url: str, content_type: str = "") -> str:
 
     return ".jpg"
 
-def download_remote_image_to_path(source_url: str, destination_path: Path):
-    request = urllib.request.Request(
-        source_url,
-        headers={"User-Agent": "IFSSeeds-ImageLocalizer/1.0"}
-    )
+def write_file_atomically(destination_path: Path, payload: bytes):
+    destination_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_name = tempfile.mkstemp(dir=destination_path.parent, prefix=".tmp-")
     try:
-        with urllib.request.urlopen(request, timeout=45) as response:
-            content_type = response.headers.get("Content-Type", "")
-            normalized_content_type = content_type.split(";")[0].strip().lower()
-            if normalized_content_type and not normalized_content_type.startswith("image/"):
-                raise ValueError("URL does not point to an image")
-
-            payload = response.read(MAX_PRODUCT_IMAGE_BYTES + 1)
-            if not payload:
-                raise ValueError("Image payload is empty")
-            if len(payload) > MAX_PRODUCT_IMAGE_BYTES:
-                max_mb = MAX_PRODUCT_IMAGE_BYTES // (1024 * 1024)
-                raise ValueError(f"Image exceeds max size of {max_mb}MB")
-
-            destination_path.parent.mkdir(parents=True, exist_ok=True)
-            with destination_path.open("wb") as file_obj:
-                file_obj.write(payload)
-    except (urllib.error.URLError, urllib.error.HTTPError, TimeoutError, OSError, ValueError) as exc:
-        raise RuntimeError(f"Failed to download {source_url}: {exc}") from exc
-
-def localize_remote_image_url(image_url: str) -> tuple[str, bool]:
+        with os.fdopen(fd, "wb") as file_obj:
+            file_obj.write(payload)
+        os.replace(temp_name, destination_path)
+    except BaseException:
+        Path(temp_name).unlink(missing_ok=True)
+        raise
+
+def refresh_upload_mtime(path: Path) -> bool:
+    # A re-upload of an existing file restarts its garbage-collection grace period.
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+def content_addressed_filename(digest: str, extension: str) -> str:
+    # 128 bits of SHA-256 is plenty to avoid collisions in one uploads directory.
+    extension = ".jpg" if extension == ".jpeg" else extension
+    return f"{digest[:32]}{extension}"
+
+async def store_product_image(payload: bytes, extension: str) -> tuple[str, bool]:
+    """Store image bytes under their content hash.
+
+    Returns the /uploads URL and whether a new file was written; identical
+    bytes always map to the same URL, so duplicates are stored once.
+    """
+    stored_filename = content_addressed_filename(hashlib.sha256(payload).hexdigest(), extension)
+    image_url = f"/uploads/products/{stored_filename}"
+    if uploads_manifest.contains_url(image_url) and await asyncio.to_thread(
+        refresh_upload_mtime, PRODUCT_UPLOADS_DIR / stored_filename
+    ):
+        return image_url, False
+    await asyncio.to_thread(write_file_atomically, PRODUCT_UPLOADS_DIR / stored_filename, payload)
+    uploads_manifest.add_url(image_url)
+    return image_url, True
+
+async def commit_product_image_file(temp_path: Path, digest: str, extension: str) -> tuple[str, bool]:
+    """Atomically move a fully written temp file to its content-addressed name."""
+    stored_filename = content_addressed_filename(digest, extension)
+    image_url = f"/uploads/products/{stored_filename}"
+    if uploads_manifest.contains_url(image_url) and await asyncio.to_thread(
+        refresh_upload_mtime, PRODUCT_UPLOADS_DIR / stored_filename
+    ):
+        return image_url, False
+    await asyncio.to_thread(os.replace, temp_path, PRODUCT_UPLOADS_DIR / stored_filename)
+    uploads_manifest.add_url(image_url)
+    return image_url, True
+
+IMAGE_SNIFF_BYTES = 16
+
+def sniff_image_extension(header: bytes) -> Optional[str]:
+    """Identify an image format from its leading bytes."""
+    if header.startswith(b"\xff\xd8\xff"):
+        return ".jpg"
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return ".png"
+    if header[:6] in (b"GIF87a", b"GIF89a"):
+        return ".gif"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return ".webp"
+    if header[4:8] == b"ftyp" and header[8:12] in (b"avif", b"avis"):
+        return ".avif"
+    return None
+
+class MultipartFileStream:
+    """Incremental multipart/form-data parser that extracts one file field.
+
+    feed() takes raw request body chunks and returns the bytes of the wanted
+    field found in them, so the caller can size-check, hash and write the
+    file as it arrives instead of buffering the whole request.
+    """
+
+    def __init__(self, boundary: bytes, field_name: str):
+        self.field_name = field_name.encode("utf-8")
+        self.found = False
+        self.filename = ""
+        self._in_field = False
+        self._headers: Dict[bytes, bytes] = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._pending: List[bytes] = []
+        self._parser = MultipartParser(boundary, callbacks={
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, params = parse_options_header(self._headers.get(b"content-disposition", b""))
+        if params.get(b"name") == self.field_name and not self.found:
+            self.found = True
+            self._in_field = True
+            self.filename = params.get(b"filename", b"").decode("utf-8", "replace")
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._in_field:
+            self._pending.append(data[start:end])
+
+    def _on_part_end(self):
+        self._in_field = False
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        self._parser.write(chunk)
+        pending, self._pending = self._pending, []
+        return pending
+
+    def finalize(self):
+        self._parser.finalize()
+
+def create_image_download_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(IMAGE_DOWNLOAD_TIMEOUT_SECONDS, connect=10),
+        limits=httpx.Limits(
+            max_connections=IMAGE_DOWNLOAD_CONCURRENCY,
+            max_keepalive_connections=IMAGE_DOWNLOAD_CONCURRENCY
+        ),
+        headers={"User-Agent": "IFSSeeds-ImageLocalizer/1.0"},
+        follow_redirects=True,
+    )
+
+class ImageDownloader:
+    """Bounded, deduplicating remote image fetcher for one localization run.
+
+    Downloads share a pooled HTTP client, are limited globally and per host,
+    and stop reading as soon as the body exceeds MAX_PRODUCT_IMAGE_BYTES.
+    """
+
+    def __init__(self, http_client: httpx.AsyncClient):
+        self.http_client = http_client
+        self._slots = asyncio.Semaphore(IMAGE_DOWNLOAD_CONCURRENCY)
+        self._host_slots: Dict[str, asyncio.Semaphore] = {}
+        self._results: Dict[str, asyncio.Task] = {}
+
+    async def _fetch(self, source_url: str) -> tuple[bytes, str]:
+        host = urlparse(source_url).hostname or ""
+        host_slots = self._host_slots.setdefault(host, asyncio.Semaphore(IMAGE_DOWNLOAD_PER_HOST_LIMIT))
+        max_mb = MAX_PRODUCT_IMAGE_BYTES // (1024 * 1024)
+        # Per-host slot first: downloads queued behind a slow host must not
+        # hold global slots that other hosts could use.
+        async with host_slots, self._slots:
+            async with self.http_client.stream("GET", source_url) as response:
+                response.raise_for_status()
+                content_type = response.headers.get("Content-Type", "")
+                normalized_content_type = content_type.split(";")[0].strip().lower()
+                if normalized_content_type and not normalized_content_type.startswith("image/"):
+                    raise ValueError("URL does not point to an image")
+                declared_length = response.headers.get("Content-Length")
+                if declared_length and declared_length.isdigit() and int(declared_length) > MAX_PRODUCT_IMAGE_BYTES:
+                    raise ValueError(f"Image exceeds max size of {max_mb}MB")
+
+                chunks = []
+                received = 0
+                async for chunk in response.aiter_bytes(64 * 1024):
+                    received += len(chunk)
+                    if received > MAX_PRODUCT_IMAGE_BYTES:
+                        raise ValueError(f"Image exceeds max size of {max_mb}MB")
+                    chunks.append(chunk)
+        payload = b"".join(chunks)
+        if not payload:
+            raise ValueError("Image payload is empty")
+        return payload, normalized_content_type
+
+    async def _download(self, source_url: str) -> tuple[str, bool]:
+        try:
+            payload, content_type = await self._fetch(source_url)
+            return await store_product_image(payload, infer_image_extension(source_url, content_type))
+        except (httpx.HTTPError, OSError, ValueError) as exc:
+            raise RuntimeError(f"Failed to download {source_url}: {exc}") from exc
+
+    async def download(self, source_url: str) -> tuple[str, bool]:
+        # Identical source URLs share a single download.
+        task = self._results.get(source_url)
+        if task is None:
+            task = asyncio.ensure_future(self._download(source_url))
+            self._results[source_url] = task
+        return await task
+
+async def localize_remote_image_url(image_url: str, downloader: ImageDownloader) -> tuple[str, bool]:
     if not image_url or not REMOTE_IMAGE_PATTERN.match(image_url):
         return image_url, False
 
     mapped_local = REMOTE_IMAGE_LOCAL_MAP.get(image_url)
-    if mapped_local:
-        target_local_url = mapped_local
-    else:
-        filename_hash = hashlib.sha1(image_url.encode("utf-8")).hexdigest()[:20]
-        target_extension = infer_image_extension(image_url)
-        target_local_url = f"/uploads/products/{filename_hash}{target_extension}"
+    if mapped_local and uploads_manifest.contains_url(mapped_local):
+        return mapped_local, False
 
-    target_path = local_image_url_to_file_path(target_local_url)
-    if target_path is None:
-        return image_url, False
+    # Stored under the hash of the downloaded bytes, so two URLs serving the
+    # same picture share one file.
+    return await downloader.download(image_url)
+
+# ============== IMAGE DERIVATIVES ==============
+
+_image_process_pool: Optional[ProcessPoolExecutor] = None
+
+def get_image_process_pool() -> ProcessPoolExecutor:
+    global _image_process_pool
+    if _image_process_pool is None:
+        # spawn, not fork: the parent has Motor and executor threads running.
+        _image_process_pool = ProcessPoolExecutor(
+            max_workers=IMAGE_PROCESS_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _image_process_pool
+
+async def run_in_image_pool(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(get_image_process_pool(), func, *args)
+
+def generate_image_derivatives(
+    source_path: str,
+    output_dir: str,
+    stem: str,
+    widths: List[int],
+    formats: List[str],
+    quality: int
+) -> Dict[str, Dict[str, str]]:
+    """Resize one image into every width/format pair; runs in the process pool.
+
+    Widths larger than the original are clamped to it, so small images yield
+    a single re-encoded copy. Returns {format: {width: filename}}.
+    """
+    derivatives: Dict[str, Dict[str, str]] = {}
+    with Image.open(source_path) as opened:
+        source = ImageOps.exif_transpose(opened)
+        has_alpha = source.mode in ("RGBA", "LA", "PA") or "transparency" in source.info
+        source = source.convert("RGBA" if has_alpha else "RGB")
+        for width in sorted({min(width, source.width) for width in widths}):
+            height = max(1, round(source.height * width / source.width))
+            resized = source if width == source.width else source.resize((width, height), Image.LANCZOS)
+            for image_format in formats:
+                filename = f"{stem}-{width}w.{image_format}"
+                destination = Path(output_dir) / filename
+                temp_destination = destination.with_name(f".tmp-{filename}")
+                resized.save(
+                    temp_destination,
+                    format=image_format.upper(),
+                    quality=quality,
+                    **IMAGE_FORMAT_SAVE_OPTIONS.get(image_format, {})
+                )
+                os.replace(temp_destination, destination)
+                derivatives.setdefault(image_format, {})[str(width)] = filename
+    return derivatives
+
+def extract_image_metadata(source_path: str, placeholder_width: int, placeholder_format: str) -> Dict[str, Any]:
+    """Measure an image and build its dominant colour and LQIP; runs in the process pool."""
+    with Image.open(source_path) as opened:
+        source = ImageOps.exif_transpose(opened)
+        width, height = source.size
+        has_alpha = source.mode in ("RGBA", "LA", "PA") or "transparency" in source.info
+        rgba = source.convert("RGBA")
+        # Flatten onto white so transparent areas don't skew the colour to black.
+        flattened = Image.new("RGB", rgba.size, (255, 255, 255))
+        flattened.paste(rgba, mask=rgba.getchannel("A"))
+
+        sample = flattened.copy()
+        sample.thumbnail((64, 64))
+        palette_image = sample.quantize(colors=5)
+        count, index = max(palette_image.getcolors())
+        red, green, blue = palette_image.getpalette()[index * 3:index * 3 + 3]
+
+        placeholder_height = max(1, round(height * placeholder_width / width))
+        tiny_source = rgba if has_alpha and placeholder_format == "webp" else flattened
+        tiny = tiny_source.resize((placeholder_width, placeholder_height), Image.BILINEAR)
+        buffer = io.BytesIO()
+        tiny.save(buffer, format=placeholder_format.upper(), quality=40)
+
+    encoded = base64.b64encode(buffer.getvalue()).decode("ascii")
+    return {
+        "width": width,
+        "height": height,
+        "dominant_color": f"#{red:02x}{green:02x}{blue:02x}",
+        "placeholder": f"data:image/{placeholder_format};base64,{encoded}",
+    }
+
+async def ensure_image_asset(image_url: str) -> Optional[Dict[str, Any]]:
+    """Return the image_assets record for a product upload, creating it if needed.
+
+    The record holds the resized derivatives (srcset) and the image metadata
+    (meta); records written before metadata existed are completed in place.
+    """
+    if not image_url or not image_url.startswith("/uploads/products/") or image_url.startswith("/uploads/products/derived/"):
+        return None
+    if Path(image_url).suffix.lower() not in DERIVABLE_IMAGE_EXTENSIONS or not uploads_manifest.contains_url(image_url):
+        return None
+
+    asset = await db.image_assets.find_one({"url": image_url}, {"_id": 0})
+    if asset and asset.get("meta"):
+        return asset
+
+    source_path = local_image_url_to_file_path(image_url)
+    if asset:
+        try:
+            meta = await run_in_image_pool(
+                extract_image_metadata, str(source_path), IMAGE_PLACEHOLDER_WIDTH, IMAGE_PLACEHOLDER_FORMAT
+            )
+        except Exception:
+            logger.exception(f"Failed to read image metadata for {image_url}")
+            return asset
+        await db.image_assets.update_one({"url": image_url}, {"$set": {"meta": meta}})
+        return {**asset, "meta": meta}
+
+    try:
+        derivatives, meta = await asyncio.gather(
+            run_in_image_pool(
+                generate_image_derivatives,
+                str(source_path),
+                str(DERIVED_UPLOADS_DIR),
+                source_path.stem,
+                IMAGE_DERIVATIVE_WIDTHS,
+                IMAGE_DERIVATIVE_FORMATS,
+                IMAGE_DERIVATIVE_QUALITY
+            ),
+            run_in_image_pool(
+                extract_image_metadata, str(source_path), IMAGE_PLACEHOLDER_WIDTH, IMAGE_PLACEHOLDER_FORMAT
+            )
+        )
+    except Exception:
+        logger.exception(f"Failed to generate derivatives for {image_url}")
+        return None
+
+    srcset: Dict[str, Dict[str, str]] = {}
+    for image_format, files in derivatives.items():
+        for width, filename in files.items():
+            derived_url = f"/uploads/products/derived/{filename}"
+            uploads_manifest.add_url(derived_url)
+            srcset.setdefault(image_format, {})[width] = derived_url
+
+    asset = {"url": image_url, "srcset": srcset, "meta": meta, "created_at": datetime.now(timezone.utc).isoformat()}
+    await db.image_assets.update_one({"url": image_url}, {"$set": asset}, upsert=True)
+    return asset
+
+async def resolve_product_image_fields(image_url: str) -> Dict[str, Any]:
+    asset = await ensure_image_asset(image_url)
+    if not asset:
+        return {"image_srcset": {}, "image_meta": None}
+    return {"image_srcset": asset["srcset"], "image_meta": asset.get("meta")}
+
+# ============== PAYMENT GATEWAY ==============
+
+# Point at fake_razorpay.py for local runs, tests and benchmarks.
+RAZORPAY_API_BASE_URL = os.environ.get("RAZORPAY_API_BASE_URL", "https://api.razorpay.com/v1").rstrip("/")
+RAZORPAY_CONNECT_TIMEOUT_SECONDS = float(os.environ.get("RAZORPAY_CONNECT_TIMEOUT_SECONDS", 3))
+RAZORPAY_READ_TIMEOUT_SECONDS = float(os.environ.get("RAZORPAY_READ_TIMEOUT_SECONDS", 10))
+RAZORPAY_MAX_CONNECTIONS = int(os.environ.get("RAZORPAY_MAX_CONNECTIONS", 20))
+RAZORPAY_MAX_RETRIES = int(os.environ.get("RAZORPAY_MAX_RETRIES", 2))
+RAZORPAY_RETRY_BASE_DELAY_SECONDS = float(os.environ.get("RAZORPAY_RETRY_BASE_DELAY_SECONDS", 0.2))
+RAZORPAY_CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("RAZORPAY_CIRCUIT_FAILURE_THRESHOLD", 5))
+RAZORPAY_CIRCUIT_RESET_SECONDS = float(os.environ.get("RAZORPAY_CIRCUIT_RESET_SECONDS", 30))
+RETRYABLE_GATEWAY_STATUS_CODES = {429, 500, 502, 503, 504}
+# Only these are retried after the request may have reached Razorpay; a
+# repeated POST /orders would open a second gateway order.
+IDEMPOTENT_GATEWAY_METHODS = {"GET", "HEAD"}
+
+class PaymentGatewayError(Exception):
+    """The gateway could not be reached or rejected the request."""
+
+class CircuitBreaker:
+    """Fails fast after repeated failures, then lets one trial call through.
+
+    closed -> open after `failure_threshold` consecutive failures; open ->
+    half-open once `reset_seconds` have passed; a successful trial closes it
+    again and a failed one re-opens it.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_started_at: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        now = time.monotonic()
+        # A trial that never reported back (e.g. cancelled) stops blocking after reset_seconds.
+        if state == "half-open" and (
+            self._trial_started_at is None or now - self._trial_started_at >= self.reset_seconds
+        ):
+            self._trial_started_at = now
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_started_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_started_at = None
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+class RazorpayGateway:
+    """Async Razorpay REST client on a pooled httpx connection.
+
+    Idempotent calls are retried with full jitter backoff on transport errors,
+    timeouts and 429/5xx responses. Other calls are retried only when the
+    request provably never reached Razorpay (connection failures) or was
+    refused with 429; the circuit breaker stops calls entirely while Razorpay is
+    down so checkout fails fast instead of holding requests open.
+    """
+
+    def __init__(self, base_url: str, key_id: str, key_secret: str):
+        self.base_url = base_url
+        self.auth = (key_id, key_secret)
+        self.breaker = CircuitBreaker(RAZORPAY_CIRCUIT_FAILURE_THRESHOLD, RAZORPAY_CIRCUIT_RESET_SECONDS)
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                auth=self.auth,
+                timeout=httpx.Timeout(RAZORPAY_READ_TIMEOUT_SECONDS, connect=RAZORPAY_CONNECT_TIMEOUT_SECONDS),
+                limits=httpx.Limits(
+                    max_connections=RAZORPAY_MAX_CONNECTIONS,
+                    max_keepalive_connections=RAZORPAY_MAX_CONNECTIONS
+                )
+            )
+        return self._client
+
+    async def _request(self, method: str, path: str, payload: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        if not self.breaker.allow():
+            raise PaymentGatewayError("Payment gateway circuit is open")
+        idempotent = method.upper() in IDEMPOTENT_GATEWAY_METHODS
+        last_error = "no attempt made"
+        attempts = 0
+        for attempt in range(RAZORPAY_MAX_RETRIES + 1):
+            if attempt:
+                await asyncio.sleep(random.uniform(0, RAZORPAY_RETRY_BASE_DELAY_SECONDS * 2 ** attempt))
+            attempts += 1
+            try:
+                response = await self._get_client().request(method, path, json=payload)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as exc:
+                # Nothing was sent, so even a POST is safe to repeat.
+                last_error = f"{type(exc).__name__}: {exc}"
+                continue
+            except httpx.HTTPError as exc:
+                last_error = f"{type(exc).__name__}: {exc}"
+                if idempotent:
+                    continue
+                break
+            if response.status_code in RETRYABLE_GATEWAY_STATUS_CODES:
+                last_error = f"HTTP {response.status_code}"
+                if idempotent or response.status_code == 429:
+                    continue
+                break
+            if response.is_error:
+                # The gateway answered, so it is healthy; the request itself is wrong.
+                self.breaker.record_success()
+                raise PaymentGatewayError(f"Razorpay rejected {method} {path}: HTTP {response.status_code} {response.text[:200]}")
+            self.breaker.record_success()
+            return response.json()
+        self.breaker.record_failure()
+        raise PaymentGatewayError(f"Razorpay {method} {path} failed after {attempts} attempts: {last_error}")
+
+    async def create_order(self, amount: int, currency: str, receipt: str) -> Dict[str, Any]:
+        return await self._request("POST", "/orders", {
+            "amount": amount,
+            "currency": currency,
+            "receipt": receipt,
+            "payment_capture": 1,
+        })
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
 
-    downloaded_now = False
-    if not target_path.exists():
-        download_remote_image_to_path(image_url, target_path)
-        downloaded_now = True
+payment_gateway = RazorpayGateway(
+    RAZORPAY_API_BASE_URL,
+    os.environ.get('RAZORPAY_KEY_ID', ''),
+    os.environ.get('RAZORPAY_KEY_SECRET', '')
+)
+
+# ============== RATE LIMITING ==============
+
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# "memory" counts per worker; "mongo" shares counters between workers.
+RATE_LIMIT_STORE = os.environ.get("RATE_LIMIT_STORE", "memory").strip().lower()
+RATE_LIMIT_MAX_KEYS = int(os.environ.get("RATE_LIMIT_MAX_KEYS", 100000))
+# Behind nginx the socket peer is the proxy; take the client from X-Forwarded-For.
+TRUST_PROXY_HEADERS = os.environ.get("TRUST_PROXY_HEADERS", "false").lower() == "true"
+
+# "<requests>/<seconds>" per route and key scope; override with
+# RATE_LIMIT_<ROUTE>_<SCOPE>, e.g. RATE_LIMIT_LOGIN_EMAIL=10/60, or "off".
+RATE_LIMIT_DEFAULTS: Dict[str, Dict[str, str]] = {
+    "login": {"ip": "20/60", "email": "5/60"},
+    "register": {"ip": "5/600"},
+    "forgot_password": {"ip": "5/600", "email": "3/3600"},
+    "reset_password": {"ip": "10/600"},
+    "contact": {"ip": "5/600"},
+    "coupon_validate": {"ip": "30/60"},
+    "seed": {"ip": "3/3600"},
+}
+
+def parse_rate_limit(value: str) -> Optional[tuple[int, float]]:
+    value = value.strip().lower()
+    if value in ("", "0", "off", "none"):
+        return None
+    limit, _, window = value.partition("/")
+    return int(limit), float(window)
+
+RATE_LIMIT_RULES: Dict[str, Dict[str, tuple[int, float]]] = {}
+for _route, _scopes in RATE_LIMIT_DEFAULTS.items():
+    for _scope, _default in _scopes.items():
+        _rule = parse_rate_limit(os.environ.get(f"RATE_LIMIT_{_route.upper()}_{_scope.upper()}", _default))
+        if _rule:
+            RATE_LIMIT_RULES.setdefault(_route, {})[_scope] = _rule
+
+def sliding_window_decision(
+    previous: int,
+    current: int,
+    limit: int,
+    window: float,
+    now: float
+) -> tuple[bool, float]:
+    """Sliding-window counter: weigh the previous fixed window by its overlap.
+
+    `current` already includes the request being decided. Returns (allowed,
+    retry_after_seconds).
+    """
+    elapsed = now % window
+    weight = 1 - elapsed / window
+    if previous * weight + current <= limit:
+        return True, 0.0
+    if current > limit or previous == 0:
+        return False, window - elapsed
+    # Wait until enough of the previous window has slid out.
+    required_weight = (limit - current) / previous
+    return False, max((1 - required_weight) * window - elapsed, 1.0)
+
+class InMemoryRateLimitStore:
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        # key -> [window index, count in that window, count in the window before]
+        self._windows: "OrderedDict[str, List[int]]" = OrderedDict()
+
+    async def hit(self, key: str, limit: int, window: float) -> tuple[bool, float]:
+        now = time.time()
+        index = int(now // window)
+        state = self._windows.get(key)
+        if state is None or state[0] < index - 1:
+            state = [index, 0, 0]
+        elif state[0] == index - 1:
+            state = [index, 0, state[1]]
+        self._windows[key] = state
+        self._windows.move_to_end(key)
+        while len(self._windows) > self.max_keys:
+            self._windows.popitem(last=False)
+
+        allowed, retry_after = sliding_window_decision(state[2], state[1] + 1, limit, window, now)
+        if allowed:
+            state[1] += 1
+        return allowed, retry_after
+
+class MongoRateLimitStore:
+    """Shared counters: one document per key and fixed window, expired by a TTL index.
+
+    The hit is counted up front so concurrent workers see each other, and
+    taken back if it is refused.
+    """
+
+    async def hit(self, key: str, limit: int, window: float) -> tuple[bool, float]:
+        now = time.time()
+        index = int(now // window)
+        expires_at = datetime.fromtimestamp((index + 2) * window, tz=timezone.utc)
+        counter = await db.rate_limits.find_one_and_update(
+            {"_id": f"{key}:{index}"},
+            {"$inc": {"count": 1}, "$setOnInsert": {"expires_at": expires_at}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        previous = await db.rate_limits.find_one({"_id": f"{key}:{index - 1}"})
+        allowed, retry_after = sliding_window_decision(
+            previous["count"] if previous else 0, counter["count"], limit, window, now
+        )
+        if not allowed:
+            # Like the in-memory store, only allowed hits count, so a client
+            # retrying while limited doesn't extend its own lockout.
+            await db.rate_limits.update_one({"_id": f"{key}:{index}"}, {"$inc": {"count": -1}})
+        return allowed, retry_after
+
+rate_limit_store = MongoRateLimitStore() if RATE_LIMIT_STORE == "mongo" else InMemoryRateLimitStore(RATE_LIMIT_MAX_KEYS)
+
+def get_client_ip(request: Request) -> str:
+    if TRUST_PROXY_HEADERS:
+        forwarded_for = request.headers.get("x-forwarded-for", "")
+        if forwarded_for:
+            # The closest proxy appends the real peer last; earlier entries are client-supplied.
+            return forwarded_for.split(",")[-1].strip()
+    return request.client.host if request.client else "unknown"
+
+async def enforce_rate_limit(route: str, scope: str, identity: str):
+    rule = RATE_LIMIT_RULES.get(route, {}).get(scope)
+    if not RATE_LIMIT_ENABLED or not rule or not identity:
+        return
+    limit, window = rule
+    try:
+        allowed, retry_after = await rate_limit_store.hit(f"{route}:{scope}:{identity}", limit, window)
+    except Exception:
+        # A shared-store outage must not lock everyone out of login.
+        logger.exception("Rate limit store failed; allowing request")
+        return
+    if not allowed:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests, please try again later",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+def rate_limit(route: str):
+    """Route dependency applying the per-IP rule for `route`."""
+    async def check_client_rate_limit(request: Request):
+        await enforce_rate_limit(route, "ip", get_client_ip(request))
+    return check_client_rate_limit
+
+# ============== IDEMPOTENCY ==============
+
+# Completed responses are replayed for this long; Mongo's TTL index drops them after.
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.environ.get("IDEMPOTENCY_KEY_TTL_HOURS", 24))
+# A request that never finished (worker crash) stops blocking its key after this.
+IDEMPOTENCY_LOCK_SECONDS = int(os.environ.get("IDEMPOTENCY_LOCK_SECONDS", 60))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+def request_fingerprint(payload: Any) -> str:
+    body = json.dumps(jsonable_encoder(payload), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+async def claim_idempotency_key(record_id: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+    """Take the key for this request, or return the record already holding it."""
+    now = datetime.now(timezone.utc)
+    try:
+        await db.idempotency_keys.insert_one({
+            "_id": record_id,
+            "fingerprint": fingerprint,
+            "state": "processing",
+            "locked_until": now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS),
+            "expires_at": now + timedelta(hours=IDEMPOTENCY_KEY_TTL_HOURS),
+        })
+        return None
+    except DuplicateKeyError:
+        pass
+    # Take over a lock abandoned by a worker that died mid-request.
+    taken = await db.idempotency_keys.update_one(
+        {"_id": record_id, "fingerprint": fingerprint, "state": "processing", "locked_until": {"$lt": now}},
+        {"$set": {"locked_until": now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)}}
+    )
+    if taken.modified_count:
+        return None
+    existing = await db.idempotency_keys.find_one({"_id": record_id})
+    if existing is None:
+        # Released by a failed attempt in the meantime.
+        return await claim_idempotency_key(record_id, fingerprint)
+    return existing
+
+async def run_idempotent(
+    scope: str,
+    idempotency_key: Optional[str],
+    owner: str,
+    payload: Any,
+    handler
+):
+    """Run `handler` at most once per (scope, owner, Idempotency-Key).
+
+    Retries with the same key and body replay the stored response; reusing a
+    key for a different body is a 422 and a retry that overlaps the first
+    attempt is a 409. Failed attempts release the key so they can be retried.
+    """
+    if not idempotency_key:
+        return await handler()
+    if len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise HTTPException(status_code=400, detail="Idempotency-Key is too long")
+
+    record_id = f"{scope}:{owner}:{idempotency_key}"
+    fingerprint = request_fingerprint(payload)
+    existing = await claim_idempotency_key(record_id, fingerprint)
+    if existing is not None:
+        if existing["fingerprint"] != fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+        if existing["state"] != "completed":
+            raise HTTPException(
+                status_code=409,
+                detail="A request with this Idempotency-Key is still in progress",
+                headers={"Retry-After": "1"}
+            )
+        return JSONResponse(
+            content=existing["response"],
+            status_code=existing["status_code"],
+            headers={"Idempotent-Replayed": "true"}
+        )
+
+    try:
+        result = await handler()
+    except BaseException:
+        # Shielded so a client disconnect can't leave the key locked.
+        await asyncio.shield(db.idempotency_keys.delete_one({"_id": record_id, "state": "processing"}))
+        raise
+    await db.idempotency_keys.update_one(
+        {"_id": record_id},
+        {"$set": {"state": "completed", "status_code": 200, "response": jsonable_encoder(result)},
+         "$unset": {"locked_until": ""}}
+    )
+    return result
 
-    return target_local_url, downloaded_now
+# ============== HTTP CACHING ==============
+
+PUBLIC_CACHE_MAX_AGE_SECONDS = int(os.environ.get("PUBLIC_CACHE_MAX_AGE_SECONDS", 60))
+PUBLIC_CACHE_STALE_WHILE_REVALIDATE_SECONDS = int(os.environ.get("PUBLIC_CACHE_STALE_WHILE_REVALIDATE_SECONDS", 300))
+PUBLIC_CACHE_CONTROL = os.environ.get(
+    "PUBLIC_CACHE_CONTROL",
+    f"public, max-age={PUBLIC_CACHE_MAX_AGE_SECONDS}, "
+    f"stale-while-revalidate={PUBLIC_CACHE_STALE_WHILE_REVALIDATE_SECONDS}"
+)
+# Responses that admins reload right after editing must always be revalidated.
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison, so W/ prefixes are ignored.
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip().removeprefix("W/")
+        if candidate == etag:
+            return True
+    return False
+
+def conditional_json_response(
+    request: Request,
+    body: bytes,
+    etag: Optional[str] = None,
+    cache_control: str = PUBLIC_CACHE_CONTROL
+) -> Response:
+    etag = etag or compute_etag(body)
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# ============== CATALOG LISTING ==============
+
+# Sort name -> (stored field, direction). Every option is paired with "id" as
+# a tie-breaker so the (value, id) pair of the last item is a stable cursor.
+PRODUCT_SORT_OPTIONS: Dict[str, tuple[str, int]] = {
+    "newest": ("created_at", DESCENDING),
+    "price_asc": ("min_price", ASCENDING),
+    "price_desc": ("min_price", DESCENDING),
+    "discount": ("discount_percent", DESCENDING),
+}
+DEFAULT_PRODUCT_SORT = "newest"
+DEFAULT_PRODUCT_PAGE_SIZE = 50
+MAX_PRODUCT_PAGE_SIZE = 200
+PRODUCT_FIELDS = set(Product.model_fields)
+# stock_holds lists the checkout reservations against a product; never expose it.
+PRODUCT_READ_PROJECTION = {"_id": 0, "stock_holds": 0}
+
+def compute_product_listing_fields(variants: List[Dict[str, Any]]) -> Dict[str, Any]:
+    prices = [variant["price"] for variant in variants]
+    discounts = [
+        round((variant["original_price"] - variant["price"]) * 100 / variant["original_price"], 2)
+        for variant in variants
+        if variant.get("original_price")
+    ]
+    return {
+        "min_price": min(prices, default=0),
+        "discount_percent": max(discounts, default=0),
+    }
+
+def encode_product_cursor(sort: str, value: Any, product_id: str) -> str:
+    raw = json.dumps([sort, value, product_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_product_cursor(cursor: str, sort: str) -> tuple[Any, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, value, product_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if cursor_sort != sort or not isinstance(product_id, str):
+        raise HTTPException(status_code=400, detail="Cursor does not match the requested sort")
+    # The value is compared with stored sort keys, so it must have their type.
+    sort_field, _ = PRODUCT_SORT_OPTIONS[sort]
+    if sort_field == "created_at":
+        try:
+            datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    elif isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return value, product_id
+
+def parse_product_fields(fields: Optional[str]) -> Optional[List[str]]:
+    if not fields:
+        return None
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in PRODUCT_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown product fields: {', '.join(unknown)}")
+    return ["id"] + [field for field in requested if field != "id"]
+
+def project_product(product: Dict[str, Any], fields: Optional[List[str]]) -> Dict[str, Any]:
+    if fields is None:
+        return product
+    return {field: product[field] for field in fields if field in product}
+
+async def query_product_page(
+    category: Optional[str],
+    active_only: bool,
+    sort: str,
+    after: Optional[tuple[Any, str]],
+    limit: int,
+    fields: Optional[List[str]]
+) -> tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """Keyset query against Mongo, used when the catalog cache is disabled."""
+    sort_field, direction = PRODUCT_SORT_OPTIONS[sort]
+    query: Dict[str, Any] = {}
+    if category:
+        query["category"] = category
+    if active_only:
+        query["is_active"] = True
+    if after is not None:
+        operator = "$gt" if direction == ASCENDING else "$lt"
+        after_value, after_id = after
+        query["$or"] = [
+            {sort_field: {operator: after_value}},
+            {sort_field: after_value, "id": {operator: after_id}},
+        ]
+
+    projection: Dict[str, int] = dict(PRODUCT_READ_PROJECTION)
+    if fields is not None:
+        projection = {"_id": 0, **{field: 1 for field in fields}, sort_field: 1}
+
+    docs = await db.products.find(query, projection).sort(
+        [(sort_field, direction), ("id", direction)]
+    ).limit(limit + 1).to_list(limit + 1)
+
+    last = docs[limit - 1] if len(docs) > limit else None
+    items = []
+    for doc in docs[:limit]:
+        if "image" in doc:
+            doc["image"] = get_local_image_if_available(doc["image"])
+        items.append(project_product(doc, fields))
+    return items, last
+
+async def fetch_products(category: Optional[str], active_only: bool) -> List[Dict[str, Any]]:
+    """Uncached listing, used when the catalog cache is disabled."""
+    query = {}
+    if category:
+        query["category"] = category
+    if active_only:
+        query["is_active"] = True
+    products = await db.products.find(query, PRODUCT_READ_PROJECTION).to_list(None)
+    for product in products:
+        product["image"] = get_local_image_if_available(product.get("image", ""))
+    return products
+
+def summarize_category_facets(products) -> List[Dict[str, Any]]:
+    """Active product count and in-stock count per category, sorted by name."""
+    facets: Dict[str, Dict[str, Any]] = {}
+    for product in products:
+        if not product.get("is_active"):
+            continue
+        facet = facets.setdefault(
+            product["category"],
+            {"name": product["category"], "count": 0, "in_stock": 0}
+        )
+        facet["count"] += 1
+        if any(variant.get("stock", 0) > 0 for variant in product.get("variants", [])):
+            facet["in_stock"] += 1
+    return [facets[name] for name in sorted(facets)]
+
+async def fetch_category_facets() -> List[Dict[str, Any]]:
+    """Uncached facets, used when the catalog cache is disabled."""
+    products = await db.products.find(
+        {"is_active": True}, {"_id": 0, "is_active": 1, "category": 1, "variants.stock": 1}
+    ).to_list(None)
+    return summarize_category_facets(products)
+
+async def backfill_product_listing_fields():
+    products = await db.products.find(
+        {"$or": [{"min_price": {"$exists": False}}, {"discount_percent": {"$exists": False}}]},
+        {"_id": 0, "id": 1, "variants": 1}
+    ).to_list(None)
+    if not products:
+        return
+    await db.products.bulk_write([
+        UpdateOne(
+            {"id": product["id"]},
+            {"$set": compute_product_listing_fields(product.get("variants", []))}
+        )
+        for product in products
+    ])
+    logger.info(f"Backfilled listing fields for {len(products)} products")
+
+# ============== DATABASE INDEXES ==============
+
+# Declarative index registry applied at startup, by POST
+# /api/admin/maintenance/indexes and by `python server.py ensure-indexes`.
+# Indexes use Mongo's default names so they are identified by key pattern.
+MONGO_INDEX_DEFINITIONS: Dict[str, List[Dict[str, Any]]] = {
+    "products": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        # Listing sorts: equality fields first, then the sort key and the id tie-breaker.
+        *[
+            {"keys": [*prefix, (sort_field, ASCENDING), ("id", ASCENDING)]}
+            for sort_field in sorted({field for field, _ in PRODUCT_SORT_OPTIONS.values()})
+            for prefix in ([("is_active", ASCENDING)], [("is_active", ASCENDING), ("category", ASCENDING)])
+        ],
+    ],
+    "users": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        {"keys": [("email", ASCENDING)], "unique": True},
+        {"keys": [("role", ASCENDING)]},
+        {"keys": [("token_version_updated_at", ASCENDING)], "sparse": True},
+    ],
+    "orders": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        # Customer order history, paged by (created_at, id).
+        {"keys": [("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]},
+        {"keys": [("order_status", ASCENDING), ("created_at", DESCENDING)]},
+        {"keys": [("payment_status", ASCENDING)]},
+        {"keys": [("created_at", DESCENDING)]},
+        {"keys": [("stock_status", ASCENDING), ("reservation_expires_at", ASCENDING)]},
+        # Webhook lookups.
+        {"keys": [("razorpay_order_id", ASCENDING)]},
+        {"keys": [("payment_id", ASCENDING)], "sparse": True},
+    ],
+    "coupons": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        {"keys": [("code", ASCENDING)], "unique": True},
+    ],
+    "settings": [
+        # smtp/razorpay/whatsapp have no template_key, so each type is a singleton.
+        {"keys": [("type", ASCENDING), ("template_key", ASCENDING)], "unique": True},
+    ],
+    "contact_messages": [
+        {"keys": [("created_at", DESCENDING)]},
+    ],
+    "image_assets": [
+        {"keys": [("url", ASCENDING)], "unique": True},
+    ],
+    "rate_limits": [
+        {"keys": [("expires_at", ASCENDING)], "expireAfterSeconds": 0},
+    ],
+    "scheduler_runs": [
+        {"keys": [("job", ASCENDING), ("started_at", DESCENDING)]},
+        {"keys": [("started_at", DESCENDING)]},
+        {"keys": [("expires_at", ASCENDING)], "expireAfterSeconds": 0},
+    ],
+    "idempotency_keys": [
+        {"keys": [("expires_at", ASCENDING)], "expireAfterSeconds": 0},
+    ],
+    "payment_events": [
+        {"keys": [("status", ASCENDING), ("available_at", ASCENDING)]},
+        # Only processed events carry expires_at; pending and failed ones stay.
+        {"keys": [("expires_at", ASCENDING)], "expireAfterSeconds": 0},
+    ],
+}
+
+def index_key_pattern(keys: List[tuple[str, int]]) -> tuple:
+    return tuple((field, int(direction)) for field, direction in keys)
+
+async def ensure_mongo_indexes() -> Dict[str, Any]:
+    report: Dict[str, Any] = {}
+    for collection_name, definitions in MONGO_INDEX_DEFINITIONS.items():
+        collection = db[collection_name]
+        created, errors = [], []
+        for definition in definitions:
+            options = {key: value for key, value in definition.items() if key != "keys"}
+            try:
+                created.append(await collection.create_index(definition["keys"], **options))
+            except Exception as exc:
+                # Typically existing duplicates blocking a unique index.
+                logger.error(f"Failed to create index {definition['keys']} on {collection_name}: {exc}")
+                errors.append({"keys": definition["keys"], "error": str(exc)})
+        report[collection_name] = {"indexes": created, "errors": errors}
+    return report
+
+async def build_index_report() -> Dict[str, Any]:
+    """Compare live indexes with the registry and include usage counters."""
+    report: Dict[str, Any] = {}
+    for collection_name, definitions in MONGO_INDEX_DEFINITIONS.items():
+        collection = db[collection_name]
+        existing = await collection.index_information()
+        existing_patterns = {index_key_pattern(info["key"]): name for name, info in existing.items()}
+        expected_patterns = {index_key_pattern(definition["keys"]) for definition in definitions}
+
+        usage: Dict[str, int] = {}
+        try:
+            async for stats in collection.aggregate([{"$indexStats": {}}]):
+                usage[stats["name"]] = stats["accesses"]["ops"]
+        except Exception as exc:
+            logger.warning(f"$indexStats unavailable for {collection_name}: {exc}")
+
+        report[collection_name] = {
+            "missing": [
+                definition["keys"] for definition in definitions
+                if index_key_pattern(definition["keys"]) not in existing_patterns
+            ],
+            "unregistered": [
+                name for pattern, name in existing_patterns.items()
+                if pattern not in expected_patterns and name != "_id_"
+            ],
+            # Access counters reset when mongod restarts.
+            "unused": sorted(name for name, ops in usage.items() if ops == 0 and name != "_id_"),
+            "usage": usage,
+        }
+    return report
+
+# ============== CATALOG CACHE ==============
+
+CATALOG_CACHE_ENABLED = os.environ.get("CATALOG_CACHE_ENABLED", "true").lower() == "true"
+# Safety net for writes made by other workers or directly in Mongo.
+CATALOG_CACHE_MAX_AGE_SECONDS = int(os.environ.get("CATALOG_CACHE_MAX_AGE_SECONDS", 300))
+
+def serialize_json(payload: Any) -> bytes:
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+def compute_etag(body: bytes) -> str:
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+class ProductCatalogCache:
+    """In-memory snapshot of the product catalog.
+
+    The snapshot is loaded from Mongo once, validated against the Product model
+    and then reused until a product write calls invalidate(). Listing payloads
+    are serialized lazily, once per snapshot and category/active_only pair.
+    """
+
+    def __init__(self, max_age_seconds: int):
+        self.max_age_seconds = max_age_seconds
+        self.version = 0
+        self._products: Optional[Dict[str, Dict[str, Any]]] = None
+        self._built_at = 0.0
+        self._generation = 0
+        self._built_generation = -1
+        self._list_payloads: Dict[tuple, tuple[bytes, str]] = {}
+        self._facet_list_payloads: Dict[tuple, tuple[bytes, str]] = {}
+        self._product_payloads: Dict[str, tuple[bytes, str]] = {}
+        self._sort_keys: Dict[str, List[tuple[Any, str]]] = {}
+        self._facets: Optional[List[Dict[str, Any]]] = None
+        self._categories_payload: Optional[tuple[bytes, str]] = None
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self._generation += 1
+
+    def _is_fresh(self) -> bool:
+        return (
+            self._products is not None
+            and self._built_generation == self._generation
+            and time.monotonic() - self._built_at < self.max_age_seconds
+        )
+
+    async def _rebuild(self):
+        generation = self._generation
+        docs = await db.products.find({}, PRODUCT_READ_PROJECTION).to_list(None)
+        products: Dict[str, Dict[str, Any]] = {}
+        for doc in docs:
+            doc["image"] = get_local_image_if_available(doc.get("image", ""))
+            doc.update(compute_product_listing_fields(doc.get("variants", [])))
+            try:
+                products[doc["id"]] = Product(**doc).model_dump(mode="json")
+            except (KeyError, ValueError) as exc:
+                logger.warning(f"Skipping invalid product {doc.get('id')} in catalog cache: {exc}")
+
+        self._products = products
+        self._list_payloads = {}
+        self._facet_list_payloads = {}
+        self._product_payloads = {}
+        self._sort_keys = {}
+        self._facets = None
+        self._categories_payload = None
+        self._built_at = time.monotonic()
+        self._built_generation = generation
+        self.version += 1
+
+    async def get_products(self) -> Dict[str, Dict[str, Any]]:
+        if not self._is_fresh():
+            async with self._lock:
+                if not self._is_fresh():
+                    await self._rebuild()
+        return self._products
+
+    async def list_products(self, category: Optional[str], active_only: bool) -> List[Dict[str, Any]]:
+        products = await self.get_products()
+        return [
+            product for product in products.values()
+            if (not category or product["category"] == category)
+            and (not active_only or product["is_active"])
+        ]
+
+    async def list_payload(self, category: Optional[str], active_only: bool) -> tuple[bytes, str]:
+        await self.get_products()
+        key = (category or None, active_only)
+        payload = self._list_payloads.get(key)
+        if payload is None:
+            body = serialize_json(await self.list_products(category, active_only))
+            payload = (body, compute_etag(body))
+            self._list_payloads[key] = payload
+        return payload
+
+    async def facet_list_payload(self, category: Optional[str], active_only: bool) -> tuple[bytes, str]:
+        """The full listing wrapped in a ProductPage envelope with facets."""
+        await self.get_products()
+        key = (category or None, active_only)
+        payload = self._facet_list_payloads.get(key)
+        if payload is None:
+            body = serialize_json({
+                "items": await self.list_products(category, active_only),
+                "next_cursor": None,
+                "facets": await self.category_facets(),
+            })
+            payload = (body, compute_etag(body))
+            self._facet_list_payloads[key] = payload
+        return payload
+
+    async def category_facets(self) -> List[Dict[str, Any]]:
+        """Active product count and in-stock count per category."""
+        products = await self.get_products()
+        if self._facets is None:
+            self._facets = summarize_category_facets(products.values())
+        return self._facets
+
+    async def categories_payload(self) -> tuple[bytes, str]:
+        facets = await self.category_facets()
+        if self._categories_payload is None:
+            body = serialize_json({
+                "categories": ["All"] + [facet["name"] for facet in facets],
+                "facets": facets,
+            })
+            self._categories_payload = (body, compute_etag(body))
+        return self._categories_payload
+
+    async def page(
+        self,
+        category: Optional[str],
+        active_only: bool,
+        sort: str,
+        after: Optional[tuple[Any, str]],
+        limit: int,
+        fields: Optional[List[str]]
+    ) -> tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """Keyset page over the snapshot, ordered like query_product_page."""
+        products = await self.get_products()
+        sort_field, direction = PRODUCT_SORT_OPTIONS[sort]
+        keys = self._sort_keys.get(sort_field)
+        if keys is None:
+            keys = sorted((product[sort_field], product["id"]) for product in products.values())
+            self._sort_keys[sort_field] = keys
+
+        if direction == ASCENDING:
+            start = bisect.bisect_right(keys, after) if after is not None else 0
+            ordered_keys = keys[start:]
+        else:
+            end = bisect.bisect_left(keys, after) if after is not None else len(keys)
+            ordered_keys = reversed(keys[:end])
+
+        matches = []
+        for _, product_id in ordered_keys:
+            product = products[product_id]
+            if category and product["category"] != category:
+                continue
+            if active_only and not product["is_active"]:
+                continue
+            matches.append(product)
+            if len(matches) > limit:
+                break
+
+        last = matches[limit - 1] if len(matches) > limit else None
+        return [project_product(product, fields) for product in matches[:limit]], last
+
+    async def product_payload(self, product_id: str) -> Optional[tuple[bytes, str]]:
+        products = await self.get_products()
+        product = products.get(product_id)
+        if product is None:
+            return None
+        payload = self._product_payloads.get(product_id)
+        if payload is None:
+            body = serialize_json(product)
+            payload = (body, compute_etag(body))
+            self._product_payloads[product_id] = payload
+        return payload
+
+product_catalog = ProductCatalogCache(CATALOG_CACHE_MAX_AGE_SECONDS)
+
+# ============== PRODUCT SEARCH ==============
+
+SEARCH_FIELD_WEIGHTS: Dict[str, float] = {
+    "name": 3.0,
+    "variety": 3.0,
+    "category": 2.0,
+    "features": 1.0,
+    "description": 0.5,
+}
+# Prefix matches rank below whole-word matches of the same token.
+SEARCH_PREFIX_MATCH_FACTOR = 0.7
+SEARCH_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:-[a-z0-9]+)*")
+
+def tokenize_search_text(text: str) -> List[str]:
+    tokens = []
+    for token in SEARCH_TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        if "-" in token:
+            # "sr-23" is also indexed as "sr", "23" and "sr23".
+            parts = token.split("-")
+            tokens.extend(parts)
+            tokens.append("".join(parts))
+    return tokens
+
+class ProductSearchIndex:
+    """Inverted index over the catalog snapshot.
+
+    sync() compares each product's searchable text with what was indexed
+    before, so only added, changed or removed products touch the postings.
+    Tokens are also kept sorted for prefix lookups.
+    """
+
+    def __init__(self):
+        self.catalog_version = -1
+        self._documents: Dict[str, tuple] = {}
+        self._doc_tokens: Dict[str, Dict[str, float]] = {}
+        self._postings: Dict[str, Dict[str, float]] = {}
+        self._sorted_tokens: List[str] = []
+
+    @staticmethod
+    def _searchable(product: Dict[str, Any]) -> tuple:
+        return tuple(
+            " ".join(product.get(field) or []) if field == "features" else product.get(field) or ""
+            for field in SEARCH_FIELD_WEIGHTS
+        )
+
+    def _remove(self, product_id: str):
+        for token in self._doc_tokens.pop(product_id, {}):
+            posting = self._postings[token]
+            posting.pop(product_id, None)
+            if not posting:
+                del self._postings[token]
+                del self._sorted_tokens[bisect.bisect_left(self._sorted_tokens, token)]
+        self._documents.pop(product_id, None)
+
+    def _add(self, product_id: str, searchable: tuple):
+        weights: Dict[str, float] = {}
+        for weight, text in zip(SEARCH_FIELD_WEIGHTS.values(), searchable):
+            for token in tokenize_search_text(text):
+                weights[token] = weights.get(token, 0.0) + weight
+        for token, weight in weights.items():
+            posting = self._postings.get(token)
+            if posting is None:
+                posting = self._postings[token] = {}
+                bisect.insort(self._sorted_tokens, token)
+            posting[product_id] = weight
+        self._doc_tokens[product_id] = weights
+        self._documents[product_id] = searchable
+
+    def sync(self, products: Dict[str, Dict[str, Any]], catalog_version: int):
+        if catalog_version == self.catalog_version:
+            return
+        for product_id in [product_id for product_id in self._documents if product_id not in products]:
+            self._remove(product_id)
+        for product_id, product in products.items():
+            searchable = self._searchable(product)
+            if self._documents.get(product_id) != searchable:
+                self._remove(product_id)
+                self._add(product_id, searchable)
+        self.catalog_version = catalog_version
+
+    def _tokens_with_prefix(self, prefix: str) -> List[str]:
+        start = bisect.bisect_left(self._sorted_tokens, prefix)
+        matches = []
+        for token in self._sorted_tokens[start:]:
+            if not token.startswith(prefix):
+                break
+            matches.append(token)
+        return matches
+
+    def _term_scores(self, term: str, prefix: bool) -> Dict[str, float]:
+        total_documents = len(self._documents) or 1
+        tokens = self._tokens_with_prefix(term) if prefix else [term]
+        scores: Dict[str, float] = {}
+        for token in tokens:
+            posting = self._postings.get(token)
+            if not posting:
+                continue
+            idf = math.log(1 + total_documents / len(posting))
+            factor = 1.0 if token == term else SEARCH_PREFIX_MATCH_FACTOR
+            for product_id, weight in posting.items():
+                score = weight * idf * factor
+                if score > scores.get(product_id, 0.0):
+                    scores[product_id] = score
+        return scores
+
+    def search(self, query: str, prefix_all_terms: bool = False) -> List[tuple[str, float]]:
+        """Return (product_id, score) pairs matching every query term.
+
+        The last term is always matched as a prefix so results follow the
+        user while typing; autocomplete treats every term as a prefix.
+        """
+        terms = SEARCH_TOKEN_PATTERN.findall(query.lower())
+        if not terms:
+            return []
+        totals: Optional[Dict[str, float]] = None
+        for position, term in enumerate(terms):
+            term_scores = self._term_scores(term, prefix_all_terms or position == len(terms) - 1)
+            if totals is None:
+                totals = term_scores
+            else:
+                totals = {
+                    product_id: score + term_scores[product_id]
+                    for product_id, score in totals.items()
+                    if product_id in term_scores
+                }
+            if not totals:
+                return []
+        return sorted(totals.items(), key=lambda item: (-item[1], item[0]))
+
+product_search_index = ProductSearchIndex()
+
+async def search_catalog(query: str, active_only: bool, prefix_all_terms: bool = False) -> List[Dict[str, Any]]:
+    products = await product_catalog.get_products()
+    product_search_index.sync(products, product_catalog.version)
+    results = []
+    for product_id, _ in product_search_index.search(query, prefix_all_terms):
+        product = products[product_id]
+        if active_only and not product["is_active"]:
+            continue
+        results.append(product)
+    return results
 
 # ============== AUTH ROUTES ==============
 
-@api_router.post("/auth/register", response_model=UserResponse)
+@api_router.post("/auth/register", response_model=UserResponse, dependencies=[Depends(rate_limit("register"))])
 async def register(user_data: UserCreate):
     normalized_email = user_data.email.lower()
     existing = await db.users.find_one({"email": normalized_email})
@@ -789,13 +2482,13 @@ async def register(user_data: UserCreate):
         "email": normalized_email,
         "name": user_data.name,
         "phone": user_data.phone,
-        "password": hash_password(user_data.password),
+        "password": await password_hasher.hash(user_data.password),
         "role": "customer",
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.users.insert_one(user_doc)
     
-    token = create_token(user_id, "customer")
+    token, refresh_token = issue_auth_tokens(user_doc)
     user_response = User(
         id=user_id,
         email=normalized_email,
@@ -804,15 +2497,17 @@ async def register(user_data: UserCreate):
         role="customer",
         created_at=user_doc["created_at"]
     )
-    return UserResponse(user=user_response, token=token)
+    return UserResponse(user=user_response, token=token, refresh_token=refresh_token)
 
-@api_router.post("/auth/login", response_model=UserResponse)
-async def login(credentials: UserLogin):
+@api_router.post("/auth/login", response_model=UserResponse, dependencies=[Depends(rate_limit("login"))])
+async def login(credentials: UserLogin, background_tasks: BackgroundTasks):
+    await enforce_rate_limit("login", "email", credentials.email.lower())
     user = await db.users.find_one({"email": credentials.email.lower()})
-    if not user or not verify_password(credentials.password, user["password"]):
+    if not user or not await password_hasher.verify(credentials.password, user["password"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    background_tasks.add_task(rehash_password_if_needed, user["id"], credentials.password, user["password"])
     
-    token = create_token(user["id"], user["role"])
+    token, refresh_token = issue_auth_tokens(user)
     user_response = User(
         id=user["id"],
         email=user["email"],
@@ -821,14 +2516,42 @@ async def login(credentials: UserLogin):
         role=user["role"],
         created_at=user["created_at"]
     )
-    return UserResponse(user=user_response, token=token)
+    return UserResponse(user=user_response, token=token, refresh_token=refresh_token)
+
+@api_router.post("/auth/refresh", response_model=UserResponse)
+async def refresh_auth_token(payload: RefreshTokenRequest):
+    try:
+        token_payload = jwt.decode(payload.refresh_token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Refresh token expired")
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
+    if token_payload.get("typ") != "refresh":
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
+
+    # Refreshing is the one place that reads the user, so profile and role
+    # changes reach the claims within one access-token lifetime.
+    user = await db.users.find_one({"id": token_payload["user_id"]}, {"_id": 0, "password": 0})
+    if not user or token_payload.get("tv", 0) < user.get("token_version", 0):
+        raise HTTPException(status_code=401, detail="Token revoked")
+    token_versions.set(user["id"], user.get("token_version", 0))
+
+    token, refresh_token = issue_auth_tokens(user)
+    return UserResponse(user=User(**user), token=token, refresh_token=refresh_token)
+
+@api_router.post("/auth/logout")
+async def logout(user: dict = Depends(get_current_user)):
+    """Sign the user out everywhere by revoking all tokens issued so far."""
+    await revoke_user_tokens(user["id"])
+    return {"message": "Logged out"}
 
 @api_router.get("/auth/me", response_model=User)
 async def get_me(user: dict = Depends(get_current_user)):
     return User(**user)
 
-@api_router.post("/auth/forgot-password")
+@api_router.post("/auth/forgot-password", dependencies=[Depends(rate_limit("forgot_password"))])
 async def forgot_password(payload: ForgotPasswordRequest, background_tasks: BackgroundTasks):
+    await enforce_rate_limit("forgot_password", "email", payload.email.lower())
     user = await db.users.find_one({"email": payload.email.lower()})
     if user:
         reset_token = create_password_reset_token(user["id"], user["email"])
@@ -850,7 +2573,7 @@ async def forgot_password(payload: ForgotPasswordRequest, background_tasks: Back
     # Intentionally generic message to avoid account enumeration.
     return {"message": "If this email exists, a password reset link has been sent."}
 
-@api_router.post("/auth/reset-password")
+@api_router.post("/auth/reset-password", dependencies=[Depends(rate_limit("reset_password"))])
 async def reset_password(payload: ResetPasswordRequest):
     token_payload = decode_password_reset_token(payload.token)
     user = await db.users.find_one({
@@ -862,79 +2585,177 @@ async def reset_password(payload: ResetPasswordRequest):
 
     await db.users.update_one(
         {"id": user["id"]},
-        {"$set": {"password": hash_password(payload.new_password)}}
+        {"$set": {"password": await password_hasher.hash(payload.new_password)}}
     )
+    # Sessions opened with the old password must not survive the reset.
+    await revoke_user_tokens(user["id"])
     return {"message": "Password reset successful"}
 
 # ============== PRODUCT ROUTES ==============
 
-@api_router.get("/products", response_model=List[Product])
-async def get_products(category: Optional[str] = None, active_only: bool = True):
-    query = {}
-    if category:
-        query["category"] = category
-    if active_only:
-        query["is_active"] = True
-    products = await db.products.find(query, {"_id": 0}).to_list(1000)
-    for product in products:
-        product["image"] = get_local_image_if_available(product.get("image", ""))
-    return products
+@api_router.get("/products", response_model=Union[List[Product], ProductPage])
+async def get_products(
+    request: Request,
+    category: Optional[str] = None,
+    active_only: bool = True,
+    sort: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PRODUCT_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    include_facets: bool = False
+):
+    cache_control = PUBLIC_CACHE_CONTROL if active_only else REVALIDATE_CACHE_CONTROL
+    # Any paging/sorting/projection parameter (or include_facets) switches to the
+    # ProductPage envelope; without them the full list is returned as before.
+    if sort or limit or cursor or fields:
+        sort = sort or DEFAULT_PRODUCT_SORT
+        if sort not in PRODUCT_SORT_OPTIONS:
+            raise HTTPException(status_code=400, detail=f"Unsupported sort: {sort}")
+        after = decode_product_cursor(cursor, sort) if cursor else None
+        page_size = limit or DEFAULT_PRODUCT_PAGE_SIZE
+        projected_fields = parse_product_fields(fields)
+        if CATALOG_CACHE_ENABLED:
+            items, last = await product_catalog.page(category, active_only, sort, after, page_size, projected_fields)
+        else:
+            items, last = await query_product_page(category, active_only, sort, after, page_size, projected_fields)
+        next_cursor = None
+        if last is not None:
+            sort_field, _ = PRODUCT_SORT_OPTIONS[sort]
+            next_cursor = encode_product_cursor(sort, last[sort_field], last["id"])
+        page = {"items": items, "next_cursor": next_cursor}
+        if include_facets:
+            if CATALOG_CACHE_ENABLED:
+                page["facets"] = await product_catalog.category_facets()
+            else:
+                page["facets"] = await fetch_category_facets()
+        return conditional_json_response(request, serialize_json(page), cache_control=cache_control)
+
+    if include_facets:
+        if CATALOG_CACHE_ENABLED:
+            body, etag = await product_catalog.facet_list_payload(category, active_only)
+            return conditional_json_response(request, body, etag, cache_control)
+        items = [Product(**product).model_dump(mode="json") for product in await fetch_products(category, active_only)]
+        page = {"items": items, "next_cursor": None, "facets": await fetch_category_facets()}
+        return conditional_json_response(request, serialize_json(page), cache_control=cache_control)
+
+    if CATALOG_CACHE_ENABLED:
+        body, etag = await product_catalog.list_payload(category, active_only)
+        return conditional_json_response(request, body, etag, cache_control)
+
+    return await fetch_products(category, active_only)
+
+@api_router.get("/products/search", response_model=ProductPage)
+async def search_products(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(20, ge=1, le=MAX_PRODUCT_PAGE_SIZE),
+    active_only: bool = True,
+    fields: Optional[str] = None
+):
+    projected_fields = parse_product_fields(fields)
+    results = await search_catalog(q, active_only)
+    body = serialize_json({
+        "items": [project_product(product, projected_fields) for product in results[:limit]],
+        "next_cursor": None,
+    })
+    return conditional_json_response(request, body)
+
+@api_router.get("/products/autocomplete")
+async def autocomplete_products(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(8, ge=1, le=20)
+):
+    results = await search_catalog(q, active_only=True, prefix_all_terms=True)
+    body = serialize_json({
+        "suggestions": [
+            {"id": product["id"], "name": product["name"], "variety": product["variety"], "image": product["image"]}
+            for product in results[:limit]
+        ]
+    })
+    return conditional_json_response(request, body)
 
 @api_router.get("/products/{product_id}", response_model=Product)
-async def get_product(product_id: str):
-    product = await db.products.find_one({"id": product_id}, {"_id": 0})
+async def get_product(request: Request, product_id: str):
+    if CATALOG_CACHE_ENABLED:
+        payload = await product_catalog.product_payload(product_id)
+        if payload is None:
+            raise HTTPException(status_code=404, detail="Product not found")
+        body, etag = payload
+        return conditional_json_response(request, body, etag)
+
+    product = await db.products.find_one({"id": product_id}, PRODUCT_READ_PROJECTION)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     product["image"] = get_local_image_if_available(product.get("image", ""))
     return product
 
 @api_router.post("/admin/products/upload-image")
-async def upload_product_image(
-    request: Request,
-    image: UploadFile = File(...),
-    admin: dict = Depends(get_admin_user)
-):
-    filename = (image.filename or "").strip()
-    if not filename:
+async def upload_product_image(request: Request, admin: dict = Depends(get_admin_user)):
+    # The multipart body is parsed here rather than through UploadFile so the
+    # image can be rejected as soon as it is too large or not an image.
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
         raise HTTPException(status_code=400, detail="Image file is required")
 
-    if image.content_type and not image.content_type.startswith("image/"):
-        raise HTTPException(status_code=400, detail="Only image files are allowed")
-
-    extension = Path(filename).suffix.lower()
-    content_type_to_ext = {
-        "image/jpeg": ".jpg",
-        "image/jpg": ".jpg",
-        "image/png": ".png",
-        "image/webp": ".webp",
-        "image/gif": ".gif",
-        "image/avif": ".avif",
-    }
-    if extension not in ALLOWED_PRODUCT_IMAGE_EXTENSIONS:
-        extension = content_type_to_ext.get(image.content_type or "", "")
-
-    if extension not in ALLOWED_PRODUCT_IMAGE_EXTENSIONS:
-        raise HTTPException(status_code=400, detail="Unsupported image format")
-
-    file_bytes = await image.read()
-    if not file_bytes:
-        raise HTTPException(status_code=400, detail="Uploaded image is empty")
-    if len(file_bytes) > MAX_PRODUCT_IMAGE_BYTES:
-        max_mb = MAX_PRODUCT_IMAGE_BYTES // (1024 * 1024)
-        raise HTTPException(status_code=400, detail=f"Image size must be {max_mb}MB or less")
-
-    stored_filename = f"{uuid.uuid4().hex}{extension}"
-    stored_path = PRODUCT_UPLOADS_DIR / stored_filename
+    max_mb = MAX_PRODUCT_IMAGE_BYTES // (1024 * 1024)
+    size_error = HTTPException(status_code=400, detail=f"Image size must be {max_mb}MB or less")
+    declared_length = request.headers.get("content-length", "")
+    if declared_length.isdigit() and int(declared_length) > MAX_PRODUCT_IMAGE_BYTES + MAX_UPLOAD_REQUEST_OVERHEAD_BYTES:
+        raise size_error
+
+    upload = MultipartFileStream(boundary, "image")
+    fd, temp_name = await asyncio.to_thread(tempfile.mkstemp, dir=PRODUCT_UPLOADS_DIR, prefix=".upload-")
+    temp_path = Path(temp_name)
+    digest = hashlib.sha256()
+    header = b""
+    size = 0
     try:
-        with stored_path.open("wb") as out_file:
-            out_file.write(file_bytes)
-    except OSError:
-        logger.exception("Failed to save uploaded product image")
-        raise HTTPException(status_code=500, detail="Failed to save image")
+        with os.fdopen(fd, "wb") as temp_file:
+            async for chunk in request.stream():
+                try:
+                    parts = upload.feed(chunk)
+                except Exception:
+                    raise HTTPException(status_code=400, detail="Malformed upload")
+                for data in parts:
+                    size += len(data)
+                    if size > MAX_PRODUCT_IMAGE_BYTES:
+                        raise size_error
+                    if len(header) < IMAGE_SNIFF_BYTES:
+                        header += data[:IMAGE_SNIFF_BYTES - len(header)]
+                        if len(header) == IMAGE_SNIFF_BYTES and sniff_image_extension(header) is None:
+                            raise HTTPException(status_code=400, detail="Unsupported image format")
+                    digest.update(data)
+                    await asyncio.to_thread(temp_file.write, data)
+            upload.finalize()
+
+        if not upload.found or not upload.filename.strip():
+            raise HTTPException(status_code=400, detail="Image file is required")
+        if size == 0:
+            raise HTTPException(status_code=400, detail="Uploaded image is empty")
+        extension = sniff_image_extension(header)
+        if extension is None:
+            raise HTTPException(status_code=400, detail="Unsupported image format")
 
-    image_url = f"/uploads/products/{stored_filename}"
+        try:
+            image_url, _ = await commit_product_image_file(temp_path, digest.hexdigest(), extension)
+        except OSError:
+            logger.exception("Failed to save uploaded product image")
+            raise HTTPException(status_code=500, detail="Failed to save image")
+    finally:
+        await asyncio.to_thread(temp_path.unlink, missing_ok=True)
+
+    stored_filename = image_url.removeprefix("/uploads/products/")
+    image_fields = await resolve_product_image_fields(image_url)
     absolute_url = f"{str(request.base_url).rstrip('/')}{image_url}"
-    return {"url": image_url, "absolute_url": absolute_url, "filename": stored_filename}
+    return {
+        "url": image_url,
+        "absolute_url": absolute_url,
+        "filename": stored_filename,
+        "srcset": image_fields["image_srcset"],
+        "meta": image_fields["image_meta"],
+    }
 
 @api_router.post("/admin/products/localize-images")
 async def localize_product_images(admin: dict = Depends(get_admin_user)):
@@ -943,33 +2764,52 @@ async def localize_product_images(admin: dict = Depends(get_admin_user)):
         {"_id": 0, "id": 1, "image": 1}
     ).to_list(2000)
 
-    updated_count = 0
+    image_urls = sorted({(product.get("image") or "").strip() for product in products} - {""})
+    async with create_image_download_client() as http_client:
+        downloader = ImageDownloader(http_client)
+        outcomes = await asyncio.gather(
+            *(localize_remote_image_url(image_url, downloader) for image_url in image_urls),
+            return_exceptions=True
+        )
+    localized = dict(zip(image_urls, outcomes))
+    local_image_urls = sorted({outcome[0] for outcome in outcomes if isinstance(outcome, tuple)})
+    local_image_fields = dict(zip(
+        local_image_urls,
+        await asyncio.gather(*(resolve_product_image_fields(url) for url in local_image_urls))
+    ))
+
+    updates = []
     downloaded_count = 0
     failed_items: List[Dict[str, str]] = []
+    now = datetime.now(timezone.utc).isoformat()
+
+    for image_url, outcome in localized.items():
+        if isinstance(outcome, tuple) and outcome[1]:
+            downloaded_count += 1
 
     for product in products:
         image_url = (product.get("image") or "").strip()
         if not image_url:
             continue
 
-        try:
-            local_image_url, downloaded_now = localize_remote_image_url(image_url)
-        except RuntimeError as exc:
-            failed_items.append({"product_id": product.get("id", ""), "image": image_url, "error": str(exc)})
+        outcome = localized[image_url]
+        if isinstance(outcome, BaseException):
+            if not isinstance(outcome, RuntimeError):
+                raise outcome
+            failed_items.append({"product_id": product.get("id", ""), "image": image_url, "error": str(outcome)})
             continue
 
-        if downloaded_now:
-            downloaded_count += 1
-
+        local_image_url, _ = outcome
         if local_image_url != image_url:
-            await db.products.update_one(
+            updates.append(UpdateOne(
                 {"id": product["id"]},
-                {"$set": {
-                    "image": local_image_url,
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }}
-            )
-            updated_count += 1
+                {"$set": {"image": local_image_url, **local_image_fields[local_image_url], "updated_at": now}}
+            ))
+
+    if updates:
+        await db.products.bulk_write(updates, ordered=False)
+        product_catalog.invalidate()
+    updated_count = len(updates)
 
     return {
         "message": "Product image localization completed",
@@ -980,6 +2820,33 @@ async def localize_product_images(admin: dict = Depends(get_admin_user)):
         "failed_items": failed_items[:20],
     }
 
+@api_router.post("/admin/products/image-derivatives")
+async def generate_product_image_derivatives(admin: dict = Depends(get_admin_user)):
+    """Backfill image_srcset/image_meta for products created before they existed."""
+    products = await db.products.find(
+        {}, {"_id": 0, "id": 1, "image": 1, "image_srcset": 1, "image_meta": 1}
+    ).to_list(None)
+    image_urls = sorted({product.get("image") or "" for product in products} - {""})
+    image_fields = dict(zip(
+        image_urls,
+        await asyncio.gather(*(resolve_product_image_fields(url) for url in image_urls))
+    ))
+
+    updates = []
+    for product in products:
+        fields = image_fields.get(product.get("image") or "")
+        if fields and any(product.get(name) != value for name, value in fields.items()):
+            updates.append(UpdateOne({"id": product["id"]}, {"$set": fields}))
+    if updates:
+        await db.products.bulk_write(updates, ordered=False)
+        product_catalog.invalidate()
+
+    return {
+        "message": "Image derivatives generated",
+        "processed_images": len(image_urls),
+        "updated_products": len(updates),
+    }
+
 @api_router.post("/admin/products", response_model=Product)
 async def create_product(product: ProductCreate, admin: dict = Depends(get_admin_user)):
     product_id = str(uuid.uuid4())
@@ -987,10 +2854,13 @@ async def create_product(product: ProductCreate, admin: dict = Depends(get_admin
     product_doc = {
         "id": product_id,
         **product.model_dump(),
+        **compute_product_listing_fields([variant.model_dump() for variant in product.variants]),
+        **await resolve_product_image_fields(product.image),
         "created_at": now,
         "updated_at": now
     }
     await db.products.insert_one(product_doc)
+    product_catalog.invalidate()
     return Product(**product_doc)
 
 @api_router.put("/admin/products/{product_id}", response_model=Product)
@@ -1000,8 +2870,14 @@ async def update_product(product_id: str, product: ProductCreate, admin: dict =
         raise HTTPException(status_code=404, detail="Product not found")
     
     now = datetime.now(timezone.utc).isoformat()
-    update_doc = {**product.model_dump(), "updated_at": now}
+    update_doc = {
+        **product.model_dump(),
+        **compute_product_listing_fields([variant.model_dump() for variant in product.variants]),
+        **await resolve_product_image_fields(product.image),
+        "updated_at": now
+    }
     await db.products.update_one({"id": product_id}, {"$set": update_doc})
+    product_catalog.invalidate()
     
     updated = await db.products.find_one({"id": product_id}, {"_id": 0})
     return Product(**updated)
@@ -1011,26 +2887,250 @@ async def delete_product(product_id: str, admin: dict = Depends(get_admin_user))
     result = await db.products.delete_one({"id": product_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
+    product_catalog.invalidate()
     return {"message": "Product deleted"}
 
 @api_router.get("/categories")
-async def get_categories():
-    categories = await db.products.distinct("category")
-    return {"categories": ["All"] + categories}
+async def get_categories(request: Request):
+    body, etag = await product_catalog.categories_payload()
+    return conditional_json_response(request, body, etag)
 
 # ============== ORDER ROUTES ==============
 
+# Only what pricing, stock checks and order lines need from each product.
+CART_PRODUCT_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "name": 1,
+    **{f"variants.{field}": 1 for field in ("id", "name", "weight", "price", "stock")},
+}
+
+async def load_cart_variants(
+    cart_items: List[CartItem]
+) -> tuple[Dict[str, Dict[str, Any]], Dict[tuple[str, str], tuple[Dict[str, Any], Dict[str, Any]]]]:
+    """Fetch every product in the cart with one $in query.
+
+    Returns the products by id and an index of (product_id, variant_id) ->
+    (product, variant), so each cart line resolves in constant time.
+    """
+    product_ids = list({cart_item.product_id for cart_item in cart_items})
+    products = {
+        product["id"]: product
+        async for product in db.products.find({"id": {"$in": product_ids}}, CART_PRODUCT_PROJECTION)
+    }
+    variant_index = {
+        (product["id"], variant["id"]): (product, variant)
+        for product in products.values()
+        for variant in product.get("variants", [])
+    }
+    return products, variant_index
+
+STOCK_RESERVATION_MINUTES = int(os.environ.get("STOCK_RESERVATION_MINUTES", 30))
+# Unpaid orders without a reservation (placed before reservations existed)
+# are expired this long after checkout.
+PENDING_ORDER_TTL_MINUTES = int(os.environ.get("PENDING_ORDER_TTL_MINUTES", 60))
+PENDING_ORDER_SWEEP_SECONDS = int(os.environ.get("PENDING_ORDER_SWEEP_SECONDS", 60))
+
+def order_stock_lines(items) -> Dict[tuple[str, str], int]:
+    """Total quantity per (product_id, variant_id) across an order's items."""
+    lines: Dict[tuple[str, str], int] = {}
+    for item in items:
+        key = (item["product_id"], item["variant_id"])
+        lines[key] = lines.get(key, 0) + item["quantity"]
+    return lines
+
+def stock_hold_id(order_id: str, variant_id: str) -> str:
+    return f"{order_id}:{variant_id}"
+
+async def reserve_order_stock(order_id: str, lines: Dict[tuple[str, str], int]) -> bool:
+    """Atomically take stock for every line, or for none of them.
+
+    Each decrement only applies while stock >= quantity, and records a hold id
+    on the product in the same update, so a partial failure is undone exactly
+    and releasing twice is harmless.
+    """
+    if not lines:
+        return True
+    result = await db.products.bulk_write([
+        UpdateOne(
+            {
+                "id": product_id,
+                "variants": {"$elemMatch": {"id": variant_id, "stock": {"$gte": quantity}}},
+                "stock_holds": {"$ne": stock_hold_id(order_id, variant_id)},
+            },
+            {
+                "$inc": {"variants.$.stock": -quantity},
+                "$push": {"stock_holds": stock_hold_id(order_id, variant_id)},
+            }
+        )
+        for (product_id, variant_id), quantity in lines.items()
+    ], ordered=False)
+    product_catalog.invalidate()
+    if result.matched_count == len(lines):
+        return True
+    await release_order_stock(order_id, lines)
+    return False
+
+async def release_order_stock(order_id: str, lines: Dict[tuple[str, str], int]):
+    """Give back held stock; lines without a hold are skipped."""
+    if not lines:
+        return
+    await db.products.bulk_write([
+        UpdateOne(
+            {"id": product_id, "stock_holds": stock_hold_id(order_id, variant_id)},
+            {
+                "$inc": {"variants.$[variant].stock": quantity},
+                "$pull": {"stock_holds": stock_hold_id(order_id, variant_id)},
+            },
+            array_filters=[{"variant.id": variant_id}]
+        )
+        for (product_id, variant_id), quantity in lines.items()
+    ], ordered=False)
+    product_catalog.invalidate()
+
+async def commit_order_stock(order_id: str, lines: Dict[tuple[str, str], int]):
+    """Drop the holds of a paid order; its stock stays taken."""
+    await db.products.bulk_write([
+        UpdateOne({"id": product_id}, {"$pull": {"stock_holds": stock_hold_id(order_id, variant_id)}})
+        for product_id, variant_id in lines
+    ], ordered=False)
+
+async def release_unpaid_order(
+    order: Dict[str, Any],
+    payment_status: str,
+    order_status: str = "pending"
+) -> bool:
+    """Cancel a still-unpaid order and return its reserved stock.
+
+    The status flip is conditional, so only one caller (customer, admin or
+    expiry sweep) ever releases a given reservation, and only while the order
+    is still in `order_status`: an order an admin has moved on is left alone.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    result = await db.orders.update_one(
+        {"id": order["id"], "stock_status": "reserved", "payment_status": "pending", "order_status": order_status},
+        {"$set": {
+            "stock_status": "released",
+            "payment_status": payment_status,
+            "order_status": "cancelled",
+            "updated_at": now
+        }}
+    )
+    if result.modified_count == 0:
+        return False
+    await release_order_stock(order["id"], order_stock_lines(order["items"]))
+    return True
+
+async def settle_paid_order_stock(order: Dict[str, Any]):
+    lines = order_stock_lines(order["items"])
+    stock_status = order.get("stock_status")
+    if stock_status == "reserved":
+        await commit_order_stock(order["id"], lines)
+    elif stock_status == "released":
+        # Paid after the reservation lapsed: take the stock again if it's still there.
+        if not await reserve_order_stock(order["id"], lines):
+            logger.error(f"Order {order['id']} was paid after its reservation expired and is short of stock")
+            await db.orders.update_one({"id": order["id"]}, {"$set": {"stock_status": "short"}})
+            return
+        await commit_order_stock(order["id"], lines)
+    elif stock_status is None:
+        # Orders from before reservations: decrement as we used to.
+        await db.products.bulk_write([
+            UpdateOne(
+                {"id": product_id, "variants.id": variant_id},
+                {"$inc": {"variants.$.stock": -quantity}}
+            )
+            for (product_id, variant_id), quantity in lines.items()
+        ], ordered=False)
+        product_catalog.invalidate()
+        return
+    else:
+        return
+    await db.orders.update_one({"id": order["id"]}, {"$set": {"stock_status": "committed"}})
+
+async def return_cancelled_order_stock(order: Dict[str, Any]):
+    """Put stock back when an admin cancels an order."""
+    # The admin route has already set order_status to cancelled.
+    if await release_unpaid_order(order, "cancelled", order_status="cancelled"):
+        return
+    result = await db.orders.update_one(
+        {"id": order["id"], "stock_status": "committed"},
+        {"$set": {"stock_status": "restocked"}}
+    )
+    if result.modified_count:
+        await db.products.bulk_write([
+            UpdateOne(
+                {"id": product_id, "variants.id": variant_id},
+                {"$inc": {"variants.$.stock": quantity}}
+            )
+            for (product_id, variant_id), quantity in order_stock_lines(order["items"]).items()
+        ], ordered=False)
+        product_catalog.invalidate()
+
+async def release_expired_reservations() -> int:
+    now = datetime.now(timezone.utc).isoformat()
+    expired = await db.orders.find(
+        {
+            "stock_status": "reserved",
+            "payment_status": "pending",
+            "order_status": "pending",
+            "reservation_expires_at": {"$lt": now},
+        },
+        {"_id": 0, "id": 1, "items": 1}
+    ).to_list(500)
+    released = 0
+    for order in expired:
+        if await release_unpaid_order(order, "expired"):
+            released += 1
+    if released:
+        logger.info(f"Released stock for {released} expired unpaid orders")
+    return released
+
+async def expire_stale_pending_orders() -> Dict[str, int]:
+    """Scheduled sweep: cancel checkouts that were never paid.
+
+    Reserved orders are released one by one so their stock comes back; the
+    rest hold no stock and are expired with a single update.
+    """
+    released = await release_expired_reservations()
+    now = datetime.now(timezone.utc)
+    result = await db.orders.update_many(
+        {
+            "payment_status": "pending",
+            "order_status": "pending",
+            "stock_status": {"$ne": "reserved"},
+            "created_at": {"$lt": (now - timedelta(minutes=PENDING_ORDER_TTL_MINUTES)).isoformat()},
+        },
+        {"$set": {"payment_status": "expired", "order_status": "cancelled", "updated_at": now.isoformat()}}
+    )
+    if result.modified_count:
+        logger.info(f"Expired {result.modified_count} stale unpaid orders")
+    return {"reservations_released": released, "orders_expired": result.modified_count}
+
 @api_router.post("/orders/create", response_model=Order)
-async def create_order(order_data: OrderCreate, background_tasks: BackgroundTasks, user: dict = Depends(get_current_user)):
+async def create_order(
+    order_data: OrderCreate,
+    user: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
+):
+    # A retried checkout replays the first order instead of opening a second one.
+    return await run_idempotent(
+        "orders-create", idempotency_key, user["id"], order_data,
+        lambda: checkout_order(order_data, user)
+    )
+
+async def checkout_order(order_data: OrderCreate, user: dict) -> Order:
+    if not order_data.items:
+        raise HTTPException(status_code=400, detail="Your cart is empty")
     items = []
     subtotal = 0
+    products, variant_index = await load_cart_variants(order_data.items)
     
     for cart_item in order_data.items:
-        product = await db.products.find_one({"id": cart_item.product_id}, {"_id": 0})
-        if not product:
+        if cart_item.product_id not in products:
             raise HTTPException(status_code=404, detail=f"Product {cart_item.product_id} not found")
         
-        variant = next((v for v in product["variants"] if v["id"] == cart_item.variant_id), None)
+        product, variant = variant_index.get((cart_item.product_id, cart_item.variant_id), (None, None))
         if not variant:
             raise HTTPException(status_code=404, detail=f"Variant {cart_item.variant_id} not found")
         
@@ -1052,6 +3152,7 @@ async def create_order(order_data: OrderCreate, background_tasks: BackgroundTask
     
     # Apply coupon
     discount = 0
+    coupon_applied = False
     if order_data.coupon_code:
         coupon = await db.coupons.find_one({
             "code": order_data.coupon_code.upper(),
@@ -1069,24 +3170,47 @@ async def create_order(order_data: OrderCreate, background_tasks: BackgroundTask
                                 discount = min(discount, coupon["max_discount"])
                         else:
                             discount = coupon["discount_value"]
-                        
-                        await db.coupons.update_one(
-                            {"code": order_data.coupon_code.upper()},
-                            {"$inc": {"usage_count": 1}}
-                        )
+                        coupon_applied = True
     
     shipping = 0 if subtotal >= 500 else 50
     total = subtotal - discount + shipping
     
+    order_id = str(uuid.uuid4())
+    stock_lines = order_stock_lines(item.model_dump() for item in items)
+    if not await reserve_order_stock(order_id, stock_lines):
+        raise HTTPException(status_code=409, detail="Some items just went out of stock, please review your cart")
+    try:
+        order_doc = await place_reserved_order(order_id, order_data, user, items, subtotal, discount, shipping, total)
+    except BaseException:
+        # Shielded so a client disconnect can't strand the reservation.
+        await asyncio.shield(release_order_stock(order_id, stock_lines))
+        raise
+    if coupon_applied:
+        # Counted only once the order exists, so failed checkouts don't use up redemptions.
+        await db.coupons.update_one(
+            {"code": order_data.coupon_code.upper()},
+            {"$inc": {"usage_count": 1}}
+        )
+    return Order(**order_doc)
+
+async def place_reserved_order(
+    order_id: str,
+    order_data: OrderCreate,
+    user: dict,
+    items: List[OrderItem],
+    subtotal: float,
+    discount: float,
+    shipping: float,
+    total: float
+) -> Dict[str, Any]:
     # Create Razorpay order
-    razorpay_order = razorpay_client.order.create({
-        "amount": int(total * 100),
-        "currency": "INR",
-        "payment_capture": 1
-    })
+    try:
+        razorpay_order = await payment_gateway.create_order(int(round(total * 100)), "INR", receipt=order_id)
+    except PaymentGatewayError as exc:
+        logger.error(f"Failed to create Razorpay order for {order_id}: {exc}")
+        raise HTTPException(status_code=503, detail="Payment gateway is unavailable, please try again shortly")
     
-    order_id = str(uuid.uuid4())
-    now = datetime.now(timezone.utc).isoformat()
+    now = datetime.now(timezone.utc)
     
     order_doc = {
         "id": order_id,
@@ -1101,19 +3225,35 @@ async def create_order(order_data: OrderCreate, background_tasks: BackgroundTask
         "payment_status": "pending",
         "razorpay_order_id": razorpay_order["id"],
         "order_status": "pending",
-        "created_at": now,
-        "updated_at": now
+        "stock_status": "reserved",
+        "reservation_expires_at": (now + timedelta(minutes=STOCK_RESERVATION_MINUTES)).isoformat(),
+        "created_at": now.isoformat(),
+        "updated_at": now.isoformat()
     }
     
     await db.orders.insert_one(order_doc)
-    
-    return Order(**order_doc)
+    order_doc.pop("_id", None)
+    return order_doc
 
 @api_router.post("/orders/{order_id}/verify-payment")
-async def verify_payment(order_id: str, payment_data: dict, background_tasks: BackgroundTasks):
-    order = await db.orders.find_one({"id": order_id}, {"_id": 0})
+async def verify_payment(
+    order_id: str,
+    payment_data: dict,
+    background_tasks: BackgroundTasks,
+    idempotency_key: Optional[str] = Header(None)
+):
+    return await run_idempotent(
+        "verify-payment", idempotency_key, order_id, payment_data,
+        lambda: confirm_order_payment(order_id, payment_data, background_tasks)
+    )
+
+async def confirm_order_payment(order_id: str, payment_data: dict, background_tasks: BackgroundTasks):
+    order = await db.orders.find_one({"id": order_id}, {"_id": 0, "id": 1, "razorpay_order_id": 1})
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
+    # A valid signature only proves the payment belongs to *some* Razorpay order.
+    if payment_data.get('razorpay_order_id') != order.get("razorpay_order_id"):
+        raise HTTPException(status_code=400, detail="Payment verification failed")
     
     try:
         razorpay_client.utility.verify_payment_signature({
@@ -1121,49 +3261,122 @@ async def verify_payment(order_id: str, payment_data: dict, background_tasks: Ba
             'razorpay_payment_id': payment_data['razorpay_payment_id'],
             'razorpay_signature': payment_data['razorpay_signature']
         })
-        
-        # Update order
-        await db.orders.update_one(
-            {"id": order_id},
-            {"$set": {
-                "payment_status": "paid",
-                "payment_id": payment_data['razorpay_payment_id'],
-                "order_status": "confirmed",
-                "updated_at": datetime.now(timezone.utc).isoformat()
-            }}
-        )
-        
-        # Update inventory
-        for item in order["items"]:
-            await db.products.update_one(
-                {"id": item["product_id"], "variants.id": item["variant_id"]},
-                {"$inc": {"variants.$.stock": -item["quantity"]}}
-            )
-        
-        # Send confirmation email
-        if order["address"].get("email"):
-            background_tasks.add_task(
-                send_templated_email,
-                order["address"]["email"],
-                "order_confirmation",
-                {
-                    "site_name": "IFS Seeds",
-                    "customer_name": order["address"]["name"],
-                    "order_id_short": order_id[:8],
-                    "order_total": str(order["total"]),
-                    "delivery_eta": "3-5 business days",
-                    "current_year": str(datetime.now(timezone.utc).year),
-                }
-            )
-        
-        return {"status": "success", "message": "Payment verified"}
     except razorpay.errors.SignatureVerificationError:
         raise HTTPException(status_code=400, detail="Payment verification failed")
+    
+    paid_order = await mark_order_paid(order_id, payment_data['razorpay_payment_id'])
+    if paid_order is None:
+        return {"status": "success", "message": "Payment already verified"}
+    background_tasks.add_task(send_order_confirmation, paid_order)
+    return {"status": "success", "message": "Payment verified"}
+
+async def mark_order_paid(order_id: str, payment_id: str) -> Optional[Dict[str, Any]]:
+    """Flip an order to paid and settle its stock; None if it was already paid.
+
+    Only the first confirmation (browser or webhook) wins, so repeats never
+    settle stock or send the confirmation twice. The returned stock_status
+    reflects any expiry that raced us.
+    """
+    paid_order = await db.orders.find_one_and_update(
+        {"id": order_id, "payment_status": {"$nin": ["paid", "refunded"]}},
+        {"$set": {
+            "payment_status": "paid",
+            "payment_id": payment_id,
+            "order_status": "confirmed",
+            "updated_at": datetime.now(timezone.utc).isoformat()
+        }},
+        return_document=ReturnDocument.AFTER
+    )
+    if paid_order is None:
+        return None
+    # Stock was reserved at checkout; paying turns the hold into a sale.
+    await settle_paid_order_stock(paid_order)
+    return paid_order
+
+async def send_order_confirmation(order: Dict[str, Any]):
+    if not order["address"].get("email"):
+        return
+    await send_templated_email(
+        order["address"]["email"],
+        "order_confirmation",
+        {
+            "site_name": "IFS Seeds",
+            "customer_name": order["address"]["name"],
+            "order_id_short": order["id"][:8],
+            "order_total": str(order["total"]),
+            "delivery_eta": "3-5 business days",
+            "current_year": str(datetime.now(timezone.utc).year),
+        }
+    )
 
-@api_router.get("/orders/my-orders", response_model=List[Order])
-async def get_my_orders(user: dict = Depends(get_current_user)):
-    orders = await db.orders.find({"user_id": user["id"]}, {"_id": 0}).sort("created_at", -1).to_list(100)
-    return orders
+@api_router.post("/orders/{order_id}/cancel")
+async def cancel_unpaid_order(order_id: str, user: dict = Depends(get_current_user)):
+    """Called when the customer closes the payment window without paying."""
+    order = await db.orders.find_one({"id": order_id, "user_id": user["id"]}, {"_id": 0, "id": 1, "items": 1})
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    if not await release_unpaid_order(order, "failed"):
+        raise HTTPException(status_code=400, detail="Order can no longer be cancelled")
+    return {"message": "Order cancelled"}
+
+DEFAULT_ORDER_PAGE_SIZE = 20
+MAX_ORDER_PAGE_SIZE = 100
+ORDER_SUMMARY_PROJECTION = {
+    "_id": 0,
+    **{field: 1 for field in OrderSummary.model_fields if field != "items"},
+    **{f"items.{field}": 1 for field in OrderSummaryItem.model_fields},
+}
+
+def encode_order_cursor(created_at: str, order_id: str) -> str:
+    raw = json.dumps([created_at, order_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_order_cursor(cursor: str) -> tuple[str, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, order_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(created_at, str) or not isinstance(order_id, str):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return created_at, order_id
+
+@api_router.get("/orders/my-orders", response_model=Union[List[Order], OrderSummaryPage])
+async def get_my_orders(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_ORDER_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    user: dict = Depends(get_current_user)
+):
+    # limit/cursor switch to paged summaries; without them the latest 100 full
+    # orders are returned as before.
+    if not (limit or cursor):
+        orders = await db.orders.find({"user_id": user["id"]}, {"_id": 0}).sort("created_at", -1).to_list(100)
+        return orders
+
+    page_size = limit or DEFAULT_ORDER_PAGE_SIZE
+    query: Dict[str, Any] = {"user_id": user["id"]}
+    if cursor:
+        after_created_at, after_id = decode_order_cursor(cursor)
+        query["$or"] = [
+            {"created_at": {"$lt": after_created_at}},
+            {"created_at": after_created_at, "id": {"$lt": after_id}},
+        ]
+    orders = await db.orders.find(query, ORDER_SUMMARY_PROJECTION).sort(
+        [("created_at", DESCENDING), ("id", DESCENDING)]
+    ).limit(page_size + 1).to_list(page_size + 1)
+
+    next_cursor = None
+    if len(orders) > page_size:
+        last = orders[page_size - 1]
+        next_cursor = encode_order_cursor(last["created_at"], last["id"])
+    return {"items": orders[:page_size], "next_cursor": next_cursor}
+
+@api_router.get("/orders/{order_id}", response_model=Order)
+async def get_my_order(order_id: str, user: dict = Depends(get_current_user)):
+    order = await db.orders.find_one({"id": order_id, "user_id": user["id"]}, {"_id": 0})
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    return order
 
 @api_router.get("/admin/orders", response_model=List[Order])
 async def get_all_orders(status: Optional[str] = None, admin: dict = Depends(get_admin_user)):
@@ -1205,6 +3418,8 @@ async def update_order_status(order_id: str, status_data: OrderStatusUpdate, bac
         {"id": order_id},
         {"$set": update_payload}
     )
+    if normalized_status == "cancelled":
+        await return_cancelled_order_stock(order)
     
     # Send status update email
     if order["address"].get("email"):
@@ -1224,9 +3439,192 @@ async def update_order_status(order_id: str, status_data: OrderStatusUpdate, bac
     
     return {"message": "Order status updated"}
 
+# ============== PAYMENT WEBHOOKS ==============
+
+# Secret configured on the webhook in the Razorpay dashboard; unset disables the endpoint.
+RAZORPAY_WEBHOOK_SECRET = os.environ.get("RAZORPAY_WEBHOOK_SECRET", "")
+PAYMENT_EVENT_TYPES = {"payment.captured", "payment.failed", "refund.processed"}
+PAYMENT_EVENT_BATCH_SIZE = int(os.environ.get("PAYMENT_EVENT_BATCH_SIZE", 50))
+# Idle workers poll this often for events received by other workers.
+PAYMENT_EVENT_POLL_SECONDS = float(os.environ.get("PAYMENT_EVENT_POLL_SECONDS", 5))
+PAYMENT_EVENT_LOCK_SECONDS = int(os.environ.get("PAYMENT_EVENT_LOCK_SECONDS", 60))
+PAYMENT_EVENT_MAX_ATTEMPTS = int(os.environ.get("PAYMENT_EVENT_MAX_ATTEMPTS", 8))
+# Processed events are kept this long so Razorpay's redeliveries are recognised.
+PAYMENT_EVENT_RETENTION_DAYS = int(os.environ.get("PAYMENT_EVENT_RETENTION_DAYS", 7))
+
+# Wakes this worker's event processor as soon as a webhook is queued.
+payment_events_queued = asyncio.Event()
+
+@api_router.post("/webhooks/razorpay")
+async def receive_razorpay_webhook(request: Request):
+    """Verify, queue and acknowledge; the event is applied by process_payment_events."""
+    if not RAZORPAY_WEBHOOK_SECRET:
+        raise HTTPException(status_code=503, detail="Webhook is not configured")
+    body = (await request.body()).decode("utf-8")
+    try:
+        razorpay_client.utility.verify_webhook_signature(
+            body, request.headers.get("x-razorpay-signature", ""), RAZORPAY_WEBHOOK_SECRET
+        )
+    except razorpay.errors.SignatureVerificationError:
+        raise HTTPException(status_code=400, detail="Invalid webhook signature")
+
+    event = json.loads(body)
+    event_type = event.get("event")
+    if event_type not in PAYMENT_EVENT_TYPES:
+        return {"status": "ignored"}
+    # Redeliveries carry the same event id, which is the queue's primary key.
+    event_id = request.headers.get("x-razorpay-event-id") or request_fingerprint(event)
+    now = datetime.now(timezone.utc)
+    try:
+        await db.payment_events.insert_one({
+            "_id": event_id,
+            "event": event_type,
+            "payload": event.get("payload", {}),
+            "status": "pending",
+            "attempts": 0,
+            "available_at": now,
+            "received_at": now,
+        })
+    except DuplicateKeyError:
+        return {"status": "duplicate"}
+    payment_events_queued.set()
+    return {"status": "queued"}
+
+async def claim_payment_events(limit: int) -> List[Dict[str, Any]]:
+    """Lease up to `limit` due events; a worker that dies mid-batch loses its lease."""
+    claimed = []
+    now = datetime.now(timezone.utc)
+    while len(claimed) < limit:
+        event = await db.payment_events.find_one_and_update(
+            {"status": "pending", "available_at": {"$lte": now}},
+            {"$set": {
+                "status": "processing",
+                "available_at": now + timedelta(seconds=PAYMENT_EVENT_LOCK_SECONDS)
+            }, "$inc": {"attempts": 1}},
+            sort=[("available_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+        if event is None:
+            break
+        claimed.append(event)
+    return claimed
+
+async def requeue_stalled_payment_events():
+    await db.payment_events.update_many(
+        {"status": "processing", "available_at": {"$lt": datetime.now(timezone.utc)}},
+        {"$set": {"status": "pending"}}
+    )
+
+async def apply_payment_captured(payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Returns the order to confirm by email, if this event is what paid it."""
+    payment = payload["payment"]["entity"]
+    order = await db.orders.find_one({"razorpay_order_id": payment["order_id"]}, {"_id": 0, "id": 1})
+    if not order:
+        # Retried: the checkout may still be inserting the order.
+        raise LookupError(f"No order for Razorpay order {payment['order_id']}")
+    return await mark_order_paid(order["id"], payment["id"])
+
+async def apply_payment_failed(payload: Dict[str, Any]):
+    # The customer may retry in the same checkout, so the order stays pending
+    # and unpaid reservations are left to the expiry sweep.
+    payment = payload["payment"]["entity"]
+    await db.orders.update_one(
+        {"razorpay_order_id": payment["order_id"], "payment_status": "pending"},
+        {"$set": {
+            "payment_error": {
+                "payment_id": payment["id"],
+                "code": payment.get("error_code"),
+                "description": payment.get("error_description"),
+            },
+            "updated_at": datetime.now(timezone.utc).isoformat()
+        }}
+    )
+
+async def apply_refund_processed(payload: Dict[str, Any]):
+    refund = payload["refund"]["entity"]
+    order = await db.orders.find_one_and_update(
+        {"payment_id": refund["payment_id"], "refunds.id": {"$ne": refund["id"]}},
+        {"$push": {"refunds": {"id": refund["id"], "amount": refund["amount"]}}},
+        projection={"id": 1, "total": 1, "refunds": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if order is None:
+        return
+    refunded = sum(entry["amount"] for entry in order["refunds"])
+    update = {"refunded_amount": refunded / 100, "updated_at": datetime.now(timezone.utc).isoformat()}
+    # Partially refunded orders stay "paid" so revenue and customer totals still count them.
+    if refunded >= int(round(order["total"] * 100)):
+        update["payment_status"] = "refunded"
+    await db.orders.update_one({"id": order["id"]}, {"$set": update})
+
+async def apply_payment_event(event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    if event["event"] == "payment.captured":
+        return await apply_payment_captured(event["payload"])
+    if event["event"] == "payment.failed":
+        await apply_payment_failed(event["payload"])
+    elif event["event"] == "refund.processed":
+        await apply_refund_processed(event["payload"])
+    return None
+
+async def process_payment_events() -> int:
+    """Apply one batch of queued events; returns how many were claimed."""
+    events = await claim_payment_events(PAYMENT_EVENT_BATCH_SIZE)
+    if not events:
+        return 0
+    done, confirmations = [], []
+    for event in events:
+        try:
+            paid_order = await apply_payment_event(event)
+        except Exception as exc:
+            exhausted = event["attempts"] >= PAYMENT_EVENT_MAX_ATTEMPTS
+            logger.warning(f"Payment event {event['_id']} ({event['event']}) failed, attempt {event['attempts']}: {exc}")
+            await db.payment_events.update_one(
+                {"_id": event["_id"]},
+                {"$set": {
+                    "status": "failed" if exhausted else "pending",
+                    # Exponential backoff, capped at an hour.
+                    "available_at": datetime.now(timezone.utc) + timedelta(seconds=min(2 ** event["attempts"], 3600)),
+                    "last_error": str(exc)
+                }}
+            )
+            continue
+        done.append(event["_id"])
+        if paid_order:
+            confirmations.append(paid_order)
+
+    now = datetime.now(timezone.utc)
+    await db.payment_events.update_many(
+        {"_id": {"$in": done}},
+        {"$set": {
+            "status": "processed",
+            "processed_at": now,
+            "expires_at": now + timedelta(days=PAYMENT_EVENT_RETENTION_DAYS)
+        }, "$unset": {"last_error": ""}}
+    )
+    for order in confirmations:
+        try:
+            await send_order_confirmation(order)
+        except Exception:
+            logger.exception(f"Failed to send confirmation for order {order['id']}")
+    return len(events)
+
+async def run_payment_event_worker():
+    while True:
+        try:
+            await requeue_stalled_payment_events()
+            while await process_payment_events() == PAYMENT_EVENT_BATCH_SIZE:
+                pass
+        except Exception:
+            logger.exception("Payment event processing failed")
+        try:
+            await asyncio.wait_for(payment_events_queued.wait(), timeout=PAYMENT_EVENT_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        payment_events_queued.clear()
+
 # ============== COUPON ROUTES ==============
 
-@api_router.post("/coupons/validate")
+@api_router.post("/coupons/validate", dependencies=[Depends(rate_limit("coupon_validate"))])
 async def validate_coupon(data: dict):
     code = data.get("code", "").upper()
     subtotal = data.get("subtotal", 0)
@@ -1324,6 +3722,7 @@ async def update_customer(user_id: str, payload: AdminCustomerUpdate, admin: dic
             "updated_at": datetime.now(timezone.utc).isoformat()
         }}
     )
+    invalidate_user_principal(user_id)
 
     updated_user = await db.users.find_one({"id": user_id}, {"_id": 0, "password": 0})
     return {"message": "User updated successfully", "user": updated_user}
@@ -1358,6 +3757,7 @@ async def update_inventory(product_id: str, variant_id: str, data: dict, admin:
     )
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Product/variant not found")
+    product_catalog.invalidate()
     return {"message": "Inventory updated"}
 
 # ============== SETTINGS ROUTES ==============
@@ -1495,20 +3895,20 @@ async def reset_email_template(template_key: str, admin: dict = Depends(get_admi
 
 # Site Settings (Public)
 @api_router.get("/settings/site")
-async def get_site_settings():
+async def get_site_settings(request: Request):
     whatsapp = await db.settings.find_one({"type": "whatsapp"}, {"_id": 0})
     razorpay_settings = await db.settings.find_one({"type": "razorpay"}, {"_id": 0})
     
-    return {
+    return conditional_json_response(request, serialize_json({
         "whatsapp_number": whatsapp.get("number") if whatsapp else os.environ.get('WHATSAPP_NUMBER', '+919950279664'),
         "whatsapp_enabled": whatsapp.get("enabled", True) if whatsapp else True,
         "instagram_url": os.environ.get('INSTAGRAM_URL', 'https://www.instagram.com/ifsseeds'),
         "razorpay_enabled": razorpay_settings.get("enabled", True) if razorpay_settings else os.environ.get('RAZORPAY_ENABLED', 'true').lower() == 'true'
-    }
+    }))
 
 # ============== CONTACT ROUTES ==============
 
-@api_router.post("/contact")
+@api_router.post("/contact", dependencies=[Depends(rate_limit("contact"))])
 async def send_contact_message(message: ContactMessage, background_tasks: BackgroundTasks):
     # Save to database
     msg_doc = {
@@ -1543,6 +3943,350 @@ async def get_contact_messages(admin: dict = Depends(get_admin_user)):
     messages = await db.contact_messages.find({}, {"_id": 0}).sort("created_at", -1).to_list(1000)
     return messages
 
+# ============== UPLOADS GC ==============
+
+UPLOADS_GC_GRACE_SECONDS = int(os.environ.get("UPLOADS_GC_GRACE_SECONDS", 24 * 3600))
+UPLOADS_GC_INTERVAL_SECONDS = int(os.environ.get("UPLOADS_GC_INTERVAL_SECONDS", 6 * 3600))
+# "quarantine" moves orphans aside (restorable); "delete" removes them outright.
+UPLOADS_GC_MODE = os.environ.get("UPLOADS_GC_MODE", "quarantine").strip().lower()
+UPLOADS_QUARANTINE_DIR = Path(os.environ.get("UPLOADS_QUARANTINE_DIR", str(ROOT_DIR / "uploads_quarantine")))
+UPLOADS_QUARANTINE_RETENTION_SECONDS = int(os.environ.get("UPLOADS_QUARANTINE_RETENTION_SECONDS", 30 * 24 * 3600))
+UPLOADS_GC_REPORT_LIMIT = 100
+PRODUCT_UPLOAD_URL_PATTERN = re.compile(r"/uploads/products/[^\s\"'()<>?#]+")
+
+def collect_product_upload_urls(value: Any, urls: set):
+    """Add every /uploads/products URL found anywhere inside a document."""
+    if isinstance(value, str):
+        urls.update(PRODUCT_UPLOAD_URL_PATTERN.findall(value))
+    elif isinstance(value, dict):
+        for item in value.values():
+            collect_product_upload_urls(item, urls)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            collect_product_upload_urls(item, urls)
+
+async def mark_referenced_product_uploads() -> set:
+    """Relative paths under PRODUCT_UPLOADS_DIR that must be kept."""
+    urls = set(REMOTE_IMAGE_LOCAL_MAP.values()) | SEED_PRODUCT_IMAGE_URLS
+    async for product in db.products.find({}, {"_id": 0, "image_meta": 0}):
+        collect_product_upload_urls(product, urls)
+    async for settings_doc in db.settings.find({}, {"_id": 0}):
+        collect_product_upload_urls(settings_doc, urls)
+    # Derivatives of a kept original stay even if a product's srcset is stale.
+    referenced_originals = list(urls)
+    for start in range(0, len(referenced_originals), 500):
+        batch = referenced_originals[start:start + 500]
+        async for asset in db.image_assets.find({"url": {"$in": batch}}, {"_id": 0, "srcset": 1}):
+            collect_product_upload_urls(asset.get("srcset"), urls)
+    return {url.removeprefix("/uploads/products/") for url in urls}
+
+def sweep_product_uploads(
+    root: Path,
+    referenced: set,
+    grace_seconds: int,
+    mode: str,
+    quarantine_dir: Path,
+    dry_run: bool
+) -> Dict[str, Any]:
+    """Remove or quarantine unreferenced product uploads older than the grace period.
+
+    Leftover temp files (".tmp-*", ".upload-*") are always deleted once past
+    the grace period. Precompressed siblings follow their source file.
+    """
+    now = time.time()
+    report: Dict[str, Any] = {
+        "scanned_files": 0,
+        "kept_files": 0,
+        "orphaned_count": 0,
+        "orphaned_bytes": 0,
+        "orphaned_files": [],
+        "stale_temp_files": 0,
+        "swept_paths": [],
+    }
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = Path(dirpath) / filename
+            relative_path = path.relative_to(root).as_posix()
+            report["scanned_files"] += 1
+            try:
+                stat_result = path.stat()
+            except FileNotFoundError:
+                continue
+            if now - stat_result.st_mtime < grace_seconds:
+                report["kept_files"] += 1
+                continue
+
+            if filename.startswith("."):
+                report["stale_temp_files"] += 1
+                if not dry_run:
+                    path.unlink(missing_ok=True)
+                continue
+
+            source_path = relative_path
+            for _, suffix in PRECOMPRESSED_ENCODINGS:
+                source_path = source_path.removesuffix(suffix)
+            if source_path in referenced:
+                report["kept_files"] += 1
+                continue
+
+            report["orphaned_count"] += 1
+            report["orphaned_bytes"] += stat_result.st_size
+            if len(report["orphaned_files"]) < UPLOADS_GC_REPORT_LIMIT:
+                report["orphaned_files"].append(relative_path)
+            if dry_run:
+                continue
+            report["swept_paths"].append(relative_path)
+            if mode == "delete":
+                path.unlink(missing_ok=True)
+            else:
+                destination = quarantine_dir / relative_path
+                destination.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(path, destination)
+    return report
+
+def purge_upload_quarantine(quarantine_dir: Path, retention_seconds: int) -> int:
+    purged = 0
+    cutoff = time.time() - retention_seconds
+    for dirpath, _, filenames in os.walk(quarantine_dir):
+        for filename in filenames:
+            path = Path(dirpath) / filename
+            try:
+                # os.replace keeps mtime, so age is measured from the quarantine move's ctime.
+                if path.stat().st_ctime < cutoff:
+                    path.unlink()
+                    purged += 1
+            except FileNotFoundError:
+                continue
+    return purged
+
+async def collect_orphaned_uploads(dry_run: bool) -> Dict[str, Any]:
+    referenced = await mark_referenced_product_uploads()
+    report = await asyncio.to_thread(
+        sweep_product_uploads,
+        PRODUCT_UPLOADS_DIR,
+        referenced,
+        UPLOADS_GC_GRACE_SECONDS,
+        UPLOADS_GC_MODE,
+        UPLOADS_QUARANTINE_DIR / "products",
+        dry_run
+    )
+    swept_urls = [f"/uploads/products/{path}" for path in report.pop("swept_paths")]
+    report.update({
+        "dry_run": dry_run,
+        "mode": UPLOADS_GC_MODE,
+        "grace_seconds": UPLOADS_GC_GRACE_SECONDS,
+        "referenced_files": len(referenced),
+    })
+    if dry_run:
+        return report
+
+    for url in swept_urls:
+        uploads_manifest.discard_url(url)
+    if swept_urls:
+        # Forget derivative records of swept originals so a re-upload regenerates them.
+        await db.image_assets.delete_many({"url": {"$in": swept_urls}})
+        logger.info(
+            f"Uploads GC {UPLOADS_GC_MODE}d {len(swept_urls)} orphaned files "
+            f"({report['orphaned_bytes']} bytes), removed {report['stale_temp_files']} stale temp files"
+        )
+    if UPLOADS_GC_MODE != "delete":
+        report["purged_from_quarantine"] = await asyncio.to_thread(
+            purge_upload_quarantine, UPLOADS_QUARANTINE_DIR, UPLOADS_QUARANTINE_RETENTION_SECONDS
+        )
+    return report
+
+# ============== SCHEDULER ==============
+
+SCHEDULER_ENABLED = os.environ.get("SCHEDULER_ENABLED", "true").lower() == "true"
+# The leader renews its lease every tick; if it dies another worker takes
+# over once the lease lapses.
+SCHEDULER_LEASE_SECONDS = int(os.environ.get("SCHEDULER_LEASE_SECONDS", 30))
+SCHEDULER_TICK_SECONDS = float(os.environ.get("SCHEDULER_TICK_SECONDS", 5))
+SCHEDULER_RUN_RETENTION_DAYS = int(os.environ.get("SCHEDULER_RUN_RETENTION_DAYS", 7))
+
+class JobScheduler:
+    """Periodic jobs for every worker process.
+
+    Leader-only jobs (shared maintenance) run on whichever worker holds the
+    Mongo lease and record their runs in scheduler_runs; per-worker jobs
+    (refreshing local caches) run everywhere and keep only in-memory stats.
+    A job never overlaps with itself.
+    """
+
+    LEASE_ID = "scheduler"
+
+    def __init__(self, lease_seconds: int, tick_seconds: float):
+        self.lease_seconds = lease_seconds
+        self.tick_seconds = tick_seconds
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.is_leader = False
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self._running: Dict[str, asyncio.Task] = {}
+        self._loop_task: Optional[asyncio.Task] = None
+
+    def add_job(self, name: str, interval_seconds: float, job, leader_only: bool = True):
+        """Register `job` (an async callable) to run every `interval_seconds`; <= 0 disables it."""
+        if interval_seconds <= 0:
+            return
+        self.jobs[name] = {
+            "interval_seconds": interval_seconds,
+            "job": job,
+            "leader_only": leader_only,
+            "next_run_at": time.monotonic() + interval_seconds,
+            "runs": 0,
+            "failures": 0,
+            "last_run": None,
+        }
+
+    async def renew_lease(self) -> bool:
+        now = datetime.now(timezone.utc)
+        try:
+            await db.scheduler_leases.find_one_and_update(
+                {"_id": self.LEASE_ID, "$or": [{"holder": self.worker_id}, {"expires_at": {"$lt": now}}]},
+                {"$set": {
+                    "holder": self.worker_id,
+                    "expires_at": now + timedelta(seconds=self.lease_seconds),
+                    "renewed_at": now
+                }},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            # The upsert collided with another worker's live lease.
+            return False
+
+    async def release_lease(self):
+        await db.scheduler_leases.delete_one({"_id": self.LEASE_ID, "holder": self.worker_id})
+
+    async def tick(self):
+        try:
+            is_leader = await self.renew_lease()
+        except Exception:
+            logger.exception("Failed to renew scheduler lease")
+            is_leader = False
+        if is_leader != self.is_leader:
+            logger.info(f"Scheduler worker {self.worker_id} {'acquired' if is_leader else 'lost'} leadership")
+            self.is_leader = is_leader
+
+        now = time.monotonic()
+        for name, spec in self.jobs.items():
+            if spec["next_run_at"] > now or name in self._running:
+                continue
+            if spec["leader_only"] and not self.is_leader:
+                continue
+            spec["next_run_at"] = now + spec["interval_seconds"]
+            self._running[name] = asyncio.create_task(self.run_job(name), name=f"job:{name}")
+
+    async def run_job(self, name: str):
+        spec = self.jobs[name]
+        started_at = datetime.now(timezone.utc)
+        started = time.perf_counter()
+        run: Dict[str, Any] = {
+            "job": name, "worker": self.worker_id, "started_at": started_at.isoformat(), "status": "succeeded"
+        }
+        try:
+            result = await spec["job"]()
+            if isinstance(result, (dict, int)):
+                run["result"] = result
+        except Exception as exc:
+            logger.exception(f"Scheduled job {name} failed")
+            run.update({"status": "failed", "error": str(exc)})
+            spec["failures"] += 1
+        finally:
+            self._running.pop(name, None)
+        run.update({
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        })
+        spec["runs"] += 1
+        spec["last_run"] = run
+        if spec["leader_only"]:
+            try:
+                await db.scheduler_runs.insert_one({
+                    **run, "expires_at": started_at + timedelta(days=SCHEDULER_RUN_RETENTION_DAYS)
+                })
+            except Exception:
+                logger.exception(f"Failed to record run of scheduled job {name}")
+
+    async def run_forever(self):
+        while True:
+            await self.tick()
+            await asyncio.sleep(self.tick_seconds)
+
+    def start(self):
+        if self._loop_task is None:
+            self._loop_task = asyncio.create_task(self.run_forever(), name="scheduler")
+
+    async def stop(self):
+        tasks = [task for task in (self._loop_task, *self._running.values()) if task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._loop_task = None
+        if self.is_leader:
+            # Hand over straight away instead of waiting for the lease to lapse.
+            self.is_leader = False
+            try:
+                await self.release_lease()
+            except Exception:
+                logger.exception("Failed to release scheduler lease")
+
+    def describe_jobs(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        return [
+            {
+                "name": name,
+                "interval_seconds": spec["interval_seconds"],
+                "leader_only": spec["leader_only"],
+                "running": name in self._running,
+                "next_run_in_seconds": max(0.0, round(spec["next_run_at"] - now, 1)),
+                "runs": spec["runs"],
+                "failures": spec["failures"],
+                "last_run": spec["last_run"],
+            }
+            for name, spec in self.jobs.items()
+        ]
+
+scheduler = JobScheduler(SCHEDULER_LEASE_SECONDS, SCHEDULER_TICK_SECONDS)
+
+# ============== MAINTENANCE ==============
+
+@api_router.get("/admin/maintenance/indexes")
+async def get_index_report(admin: dict = Depends(get_admin_user)):
+    return await build_index_report()
+
+@api_router.post("/admin/maintenance/indexes")
+async def apply_indexes(admin: dict = Depends(get_admin_user)):
+    created = await ensure_mongo_indexes()
+    return {"message": "Indexes applied", "result": created, "report": await build_index_report()}
+
+@api_router.get("/admin/maintenance/uploads-gc")
+async def get_uploads_gc_report(admin: dict = Depends(get_admin_user)):
+    """Dry run: what the uploads GC would remove right now."""
+    return await collect_orphaned_uploads(dry_run=True)
+
+@api_router.post("/admin/maintenance/uploads-gc")
+async def run_uploads_gc(admin: dict = Depends(get_admin_user)):
+    return await collect_orphaned_uploads(dry_run=False)
+
+@api_router.get("/admin/maintenance/scheduler")
+async def get_scheduler_status(
+    job: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    admin: dict = Depends(get_admin_user)
+):
+    """Jobs as seen by this worker, the current lease and recent leader-job runs."""
+    query = {"job": job} if job else {}
+    runs = await db.scheduler_runs.find(query, {"_id": 0, "expires_at": 0}).sort("started_at", -1).to_list(limit)
+    return {
+        "enabled": SCHEDULER_ENABLED,
+        "worker": scheduler.worker_id,
+        "is_leader": scheduler.is_leader,
+        "lease": await db.scheduler_leases.find_one({"_id": JobScheduler.LEASE_ID}, {"_id": 0}),
+        "jobs": scheduler.describe_jobs(),
+        "runs": runs,
+    }
+
 # ============== DASHBOARD STATS ==============
 
 @api_router.get("/admin/dashboard/stats")
@@ -1588,8 +4332,8 @@ async def get_dashboard_stats(admin: dict = Depends(get_admin_user)):
 # ============== RAZORPAY CONFIG ==============
 
 @api_router.get("/razorpay/config")
-async def get_razorpay_config():
-    return {"key_id": os.environ.get('RAZORPAY_KEY_ID', '')}
+async def get_razorpay_config(request: Request):
+    return conditional_json_response(request, serialize_json({"key_id": os.environ.get('RAZORPAY_KEY_ID', '')}))
 
 # ============== SEED DATA ==============
 
@@ -1712,7 +4456,10 @@ async def seed_initial_data(admin: dict = Depends(get_admin_user)):
         }
     ]
     
+    for product_doc in products_data:
+        product_doc.update(compute_product_listing_fields(product_doc["variants"]))
     await db.products.insert_many(products_data)
+    product_catalog.invalidate()
     
     # Create a sample coupon
     coupon_data = {
@@ -1735,7 +4482,7 @@ async def seed_initial_data(admin: dict = Depends(get_admin_user)):
 
 # ============== PUBLIC SEED DATA (No Auth) ==============
 
-@api_router.post("/seed-initial-data")
+@api_router.post("/seed-initial-data", dependencies=[Depends(rate_limit("seed"))])
 async def seed_public_data():
     """Public endpoint to seed initial data without authentication"""
     existing_products = await db.products.count_documents({})
@@ -1752,7 +4499,7 @@ async def seed_public_data():
             "email": "admin@ifsseeds.com",
             "name": "Admin",
             "phone": "9999999999",
-            "password": hash_password("admin123"),
+            "password": await password_hasher.hash("admin123"),
             "role": "admin",
             "created_at": datetime.now(timezone.utc).isoformat()
         }
@@ -1872,7 +4619,10 @@ async def seed_public_data():
         }
     ]
     
+    for product_doc in products_data:
+        product_doc.update(compute_product_listing_fields(product_doc["variants"]))
     await db.products.insert_many(products_data)
+    product_catalog.invalidate()
     
     # Create sample coupon
     coupon_data = {
@@ -1891,14 +4641,15 @@ async def seed_public_data():
     }
     await db.coupons.insert_one(coupon_data)
     
-    # Create dummy users
+    # Create dummy users (they share a password, so hash it once)
+    dummy_password_hash = await password_hasher.hash("user123")
     dummy_users = [
         {
             "id": str(uuid.uuid4()),
             "email": "rajesh.sharma@gmail.com",
             "name": "Rajesh Sharma",
             "phone": "9876543210",
-            "password": hash_password("user123"),
+            "password": dummy_password_hash,
             "role": "customer",
             "created_at": (datetime.now(timezone.utc) - timedelta(days=30)).isoformat()
         },
@@ -1907,7 +4658,7 @@ async def seed_public_data():
             "email": "priya.patel@gmail.com",
             "name": "Priya Patel",
             "phone": "9876543211",
-            "password": hash_password("user123"),
+            "password": dummy_password_hash,
             "role": "customer",
             "created_at": (datetime.now(timezone.utc) - timedelta(days=25)).isoformat()
         },
@@ -1916,7 +4667,7 @@ async def seed_public_data():
             "email": "amit.verma@gmail.com",
             "name": "Amit Verma",
             "phone": "9876543212",
-            "password": hash_password("user123"),
+            "password": dummy_password_hash,
             "role": "customer",
             "created_at": (datetime.now(timezone.utc) - timedelta(days=20)).isoformat()
         },
@@ -1925,7 +4676,7 @@ async def seed_public_data():
             "email": "sunita.devi@gmail.com",
             "name": "Sunita Devi",
             "phone": "9876543213",
-            "password": hash_password("user123"),
+            "password": dummy_password_hash,
             "role": "customer",
             "created_at": (datetime.now(timezone.utc) - timedelta(days=15)).isoformat()
         },
@@ -1934,7 +4685,7 @@ async def seed_public_data():
             "email": "ramesh.kumar@gmail.com",
             "name": "Ramesh Kumar",
             "phone": "9876543214",
-            "password": hash_password("user123"),
+            "password": dummy_password_hash,
             "role": "customer",
             "created_at": (datetime.now(timezone.utc) - timedelta(days=10)).isoformat()
         }
@@ -2044,8 +4795,206 @@ async def seed_public_data():
     
     return {"message": "Data seeded successfully", "admin_email": "admin@ifsseeds.com", "admin_password": "admin123"}
 
+# ============== STATIC UPLOADS ==============
+
+UPLOADS_CACHE_MAX_AGE_SECONDS = int(os.environ.get("UPLOADS_CACHE_MAX_AGE_SECONDS", 3600))
+UPLOADS_MUTABLE_CACHE_CONTROL = f"public, max-age={UPLOADS_CACHE_MAX_AGE_SECONDS}"
+UPLOADS_IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# "x-accel-redirect" (nginx) or "x-sendfile" (Apache/lighttpd) hands the bytes to the proxy.
+UPLOADS_SENDFILE_MODE = os.environ.get("UPLOADS_SENDFILE_MODE", "").strip().lower()
+UPLOADS_ACCEL_REDIRECT_PREFIX = os.environ.get("UPLOADS_ACCEL_REDIRECT_PREFIX", "/protected-uploads/")
+# Content-addressed uploads and their derivatives never change under the same name.
+CONTENT_ADDRESSED_FILENAME_PATTERN = re.compile(r"^[0-9a-f]{32}(-\d+w)?\.[a-z0-9]+$")
+PRECOMPRESSIBLE_UPLOAD_EXTENSIONS = {".svg", ".css", ".js", ".json", ".txt", ".xml"}
+# Preferred first; brotli is only produced when the optional module is installed.
+PRECOMPRESSED_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+UPLOADS_RANGE_CHUNK_SIZE = 64 * 1024
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+def accepted_encodings(accept_encoding: str) -> set:
+    encodings = set()
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        if name:
+            encodings.add(name.strip().lower())
+    return encodings
+
+def parse_byte_range(range_header: str, file_size: int) -> Optional[tuple[int, int]]:
+    """Parse a single "bytes=start-end" range into inclusive offsets.
+
+    Returns None when the header should be ignored (malformed or multiple
+    ranges, which are answered with the full file) and raises ValueError when
+    the range cannot be satisfied.
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    start_text, dash, end_text = spec.strip().partition("-")
+    if not dash or (start_text and not start_text.isdigit()) or (end_text and not end_text.isdigit()):
+        return None
+    if start_text:
+        start = int(start_text)
+        end = int(end_text) if end_text else max(start, file_size - 1)
+        if end < start:
+            return None
+    elif end_text:
+        suffix_length = int(end_text)
+        if suffix_length == 0:
+            raise ValueError("empty suffix range")
+        start = max(file_size - suffix_length, 0)
+        end = file_size - 1
+    else:
+        return None
+    if start >= file_size:
+        raise ValueError("range starts past end of file")
+    return start, min(end, file_size - 1)
+
+class FileRangeResponse(Response):
+    """206 response streaming one byte range of a file."""
+
+    def __init__(self, path: Path, start: int, end: int, file_size: int, headers: Dict[str, str], media_type: str):
+        self.path = path
+        self.start = start
+        self.end = end
+        headers = {**headers, "content-length": str(end - start + 1)}
+        super().__init__(status_code=206, headers=headers, media_type=media_type)
+        self.headers["content-range"] = f"bytes {start}-{end}/{file_size}"
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        remaining = self.end - self.start + 1
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.start)
+            while remaining > 0:
+                chunk = await file.read(min(UPLOADS_RANGE_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+class UploadsStaticFiles(StaticFiles):
+    """StaticFiles for /uploads with cache policy, precompression, ranges and sendfile."""
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        if status_code != 200:
+            return super().file_response(full_path, stat_result, scope, status_code)
+
+        request_headers = Headers(scope=scope)
+        path = Path(full_path)
+        media_type = mimetypes.guess_type(path.name)[0] or "text/plain"
+        served_path, served_stat, encoding = path, stat_result, None
+        compressible = path.suffix.lower() in PRECOMPRESSIBLE_UPLOAD_EXTENSIONS
+        if compressible:
+            accepted = accepted_encodings(request_headers.get("accept-encoding", ""))
+            for candidate, suffix in PRECOMPRESSED_ENCODINGS:
+                variant = path.with_name(path.name + suffix)
+                if candidate not in accepted:
+                    continue
+                try:
+                    variant_stat = os.stat(variant)
+                except OSError:
+                    continue
+                if variant_stat.st_mtime >= stat_result.st_mtime:
+                    served_path, served_stat, encoding = variant, variant_stat, candidate
+                    break
+
+        response = FileResponse(served_path, stat_result=served_stat, media_type=media_type)
+        if CONTENT_ADDRESSED_FILENAME_PATTERN.match(path.name):
+            response.headers["cache-control"] = UPLOADS_IMMUTABLE_CACHE_CONTROL
+        else:
+            response.headers["cache-control"] = UPLOADS_MUTABLE_CACHE_CONTROL
+        if compressible:
+            response.headers["vary"] = "Accept-Encoding"
+        if encoding:
+            response.headers["content-encoding"] = encoding
+        response.headers["accept-ranges"] = "bytes"
+
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+
+        if UPLOADS_SENDFILE_MODE in ("x-accel-redirect", "x-sendfile"):
+            return self.sendfile_response(served_path, response.headers, media_type)
+
+        range_header = request_headers.get("range")
+        if range_header and self.if_range_matches(request_headers, response.headers):
+            try:
+                byte_range = parse_byte_range(range_header, served_stat.st_size)
+            except ValueError:
+                return Response(
+                    status_code=416,
+                    headers={"content-range": f"bytes */{served_stat.st_size}", "accept-ranges": "bytes"}
+                )
+            if byte_range:
+                headers = {name: value for name, value in response.headers.items() if name != "content-type"}
+                return FileRangeResponse(
+                    served_path, *byte_range, served_stat.st_size, headers=headers, media_type=media_type
+                )
+        return response
+
+    @staticmethod
+    def if_range_matches(request_headers: Headers, response_headers) -> bool:
+        if_range = request_headers.get("if-range")
+        if not if_range:
+            return True
+        return if_range in (response_headers.get("etag"), response_headers.get("last-modified"))
+
+    def sendfile_response(self, served_path: Path, file_headers, media_type: str) -> Response:
+        # The proxy serves the bytes (and ranges); we only supply the headers.
+        headers = {
+            name: value for name, value in file_headers.items()
+            if name in ("cache-control", "etag", "last-modified", "vary", "content-encoding", "accept-ranges")
+        }
+        if UPLOADS_SENDFILE_MODE == "x-accel-redirect":
+            relative_path = served_path.relative_to(Path(self.directory).resolve())
+            headers["x-accel-redirect"] = UPLOADS_ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + relative_path.as_posix()
+        else:
+            headers["x-sendfile"] = str(served_path)
+        return Response(headers=headers, media_type=media_type)
+
+def precompress_upload_assets(root: Path) -> int:
+    """Write .gz (and .br when brotli is installed) siblings for text uploads.
+
+    Only missing or stale variants are produced; returns how many were written.
+    """
+    written = 0
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            source = Path(dirpath) / filename
+            if filename.startswith(".") or source.suffix.lower() not in PRECOMPRESSIBLE_UPLOAD_EXTENSIONS:
+                continue
+            source_mtime = source.stat().st_mtime
+            payload = None
+            for encoding, suffix in PRECOMPRESSED_ENCODINGS:
+                if encoding == "br" and brotli is None:
+                    continue
+                variant = source.with_name(filename + suffix)
+                if variant.exists() and variant.stat().st_mtime >= source_mtime:
+                    continue
+                if payload is None:
+                    payload = source.read_bytes()
+                if encoding == "br":
+                    compressed = brotli.compress(payload, quality=11)
+                else:
+                    compressed = gzip.compress(payload, compresslevel=9, mtime=0)
+                if len(compressed) >= len(payload):
+                    continue
+                write_file_atomically(variant, compressed)
+                written += 1
+    return written
+
 # Include router
-app.mount("/uploads", StaticFiles(directory=str(UPLOADS_DIR)), name="uploads")
+app.mount("/uploads", UploadsStaticFiles(directory=str(UPLOADS_DIR)), name="uploads")
 app.include_router(api_router)
 
 # CORS
@@ -2057,6 +5006,105 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ============== BACKGROUND JOBS ==============
+
+background_jobs: List[asyncio.Task] = []
+
+async def refresh_uploads_manifest():
+    if await asyncio.to_thread(uploads_manifest.scan):
+        # Snapshot image URLs were resolved against the previous manifest.
+        product_catalog.invalidate()
+
+@app.on_event("startup")
+async def load_uploads_manifest():
+    await refresh_uploads_manifest()
+
+async def run_uploads_gc_job() -> Dict[str, Any]:
+    return await collect_orphaned_uploads(dry_run=False)
+
+@app.on_event("startup")
+async def load_token_versions():
+    try:
+        await token_versions.sync()
+    except Exception:
+        logger.exception("Failed to load token revocations")
+
+# Per-worker caches refresh everywhere; shared maintenance runs on the leader only.
+scheduler.add_job("uploads-manifest-refresh", UPLOADS_MANIFEST_REFRESH_SECONDS, refresh_uploads_manifest, leader_only=False)
+scheduler.add_job("token-version-sync", TOKEN_VERSION_SYNC_SECONDS, token_versions.sync, leader_only=False)
+scheduler.add_job("uploads-gc", UPLOADS_GC_INTERVAL_SECONDS, run_uploads_gc_job)
+scheduler.add_job("pending-order-expiry", PENDING_ORDER_SWEEP_SECONDS, expire_stale_pending_orders)
+
+@app.on_event("startup")
+async def start_scheduler():
+    if SCHEDULER_ENABLED:
+        scheduler.start()
+
+@app.on_event("shutdown")
+async def stop_scheduler():
+    await scheduler.stop()
+
+@app.on_event("startup")
+async def start_payment_event_worker():
+    background_jobs.append(asyncio.create_task(run_payment_event_worker(), name="payment-events"))
+
+@app.on_event("startup")
+async def prepare_product_catalog():
+    try:
+        await backfill_product_listing_fields()
+    except Exception:
+        logger.exception("Failed to backfill product listing fields")
+
+@app.on_event("startup")
+async def apply_mongo_indexes():
+    try:
+        await ensure_mongo_indexes()
+    except Exception:
+        logger.exception("Failed to apply Mongo indexes")
+
+@app.on_event("startup")
+async def precompress_uploads():
+    try:
+        written = await asyncio.to_thread(precompress_upload_assets, UPLOADS_DIR)
+    except OSError:
+        logger.exception("Failed to precompress upload assets")
+        return
+    if written:
+        logger.info(f"Precompressed {written} upload asset variants")
+
+@app.on_event("shutdown")
+async def stop_background_jobs():
+    for task in background_jobs:
+        task.cancel()
+    await asyncio.gather(*background_jobs, return_exceptions=True)
+    background_jobs.clear()
+
+@app.on_event("shutdown")
+async def close_payment_gateway():
+    await payment_gateway.close()
+
+@app.on_event("shutdown")
+async def stop_password_hasher():
+    password_hasher.shutdown()
+
+@app.on_event("shutdown")
+async def stop_image_process_pool():
+    if _image_process_pool is not None:
+        _image_process_pool.shutdown(wait=False, cancel_futures=True)
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
+
+if __name__ == "__main__":
+    import sys
+
+    cli_commands = {
+        "ensure-indexes": ensure_mongo_indexes,
+        "index-report": build_index_report,
+    }
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command not in cli_commands:
+        print(f"Usage: python server.py [{'|'.join(cli_commands)}]")
+        sys.exit(2)
+    print(json.dumps(asyncio.run(cli_commands[command]()), indent=2, default=str))
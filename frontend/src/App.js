@@ -29,6 +29,62 @@ import AdminSettings from "./pages/admin/AdminSettings";
 const BACKEND_URL = (process.env.REACT_APP_BACKEND_URL || "").replace(/\/+$/, "");
 export const API = BACKEND_URL ? `${BACKEND_URL}/api` : "/api";
 
+// Session tokens. When the API issues refresh tokens, an expired access token
+// is refreshed once and the failed request retried with the new one.
+const storeSession = (data) => {
+  localStorage.setItem("token", data.token);
+  if (data.refresh_token) {
+    localStorage.setItem("refresh_token", data.refresh_token);
+  } else {
+    localStorage.removeItem("refresh_token");
+  }
+};
+
+const clearSession = () => {
+  localStorage.removeItem("token");
+  localStorage.removeItem("refresh_token");
+};
+
+let refreshInFlight = null;
+
+const refreshSession = () => {
+  if (!refreshInFlight) {
+    const refreshToken = localStorage.getItem("refresh_token");
+    refreshInFlight = axios
+      .post(`${API}/auth/refresh`, { refresh_token: refreshToken })
+      .then((res) => {
+        storeSession(res.data);
+        return res.data.token;
+      })
+      .finally(() => {
+        refreshInFlight = null;
+      });
+  }
+  return refreshInFlight;
+};
+
+axios.interceptors.response.use(undefined, async (error) => {
+  const original = error.config;
+  if (
+    error.response?.status !== 401 ||
+    !original ||
+    original._retried ||
+    original.url?.includes("/auth/") ||
+    !localStorage.getItem("refresh_token")
+  ) {
+    return Promise.reject(error);
+  }
+  original._retried = true;
+  try {
+    const token = await refreshSession();
+    original.headers = { ...original.headers, Authorization: `Bearer ${token}` };
+    return axios(original);
+  } catch (refreshError) {
+    clearSession();
+    return Promise.reject(error);
+  }
+});
+
 // Auth Context
 export const AuthContext = createContext(null);
 
@@ -88,8 +144,20 @@ function App() {
       .then(res => {
         setUser(res.data);
       })
-      .catch(() => {
-        localStorage.removeItem("token");
+      .catch(async () => {
+        if (!localStorage.getItem("refresh_token")) {
+          clearSession();
+          return;
+        }
+        try {
+          await refreshSession();
+          const res = await axios.get(`${API}/auth/me`, {
+            headers: { Authorization: `Bearer ${localStorage.getItem("token")}` }
+          });
+          setUser(res.data);
+        } catch (refreshError) {
+          clearSession();
+        }
       })
       .finally(() => setLoading(false));
     } else {
@@ -110,20 +178,27 @@ function App() {
 
   const login = async (email, password) => {
     const res = await axios.post(`${API}/auth/login`, { email, password });
-    localStorage.setItem("token", res.data.token);
+    storeSession(res.data);
     setUser(res.data.user);
     return res.data;
   };
 
   const register = async (name, email, phone, password) => {
     const res = await axios.post(`${API}/auth/register`, { name, email, phone, password });
-    localStorage.setItem("token", res.data.token);
+    storeSession(res.data);
     setUser(res.data.user);
     return res.data;
   };
 
   const logout = () => {
-    localStorage.removeItem("token");
+    const token = localStorage.getItem("token");
+    if (token && localStorage.getItem("refresh_token")) {
+      // Revoke server-side so the refresh token can't be reused.
+      axios.post(`${API}/auth/logout`, null, {
+        headers: { Authorization: `Bearer ${token}` }
+      }).catch(() => {});
+    }
+    clearSession();
     setUser(null);
   };
 
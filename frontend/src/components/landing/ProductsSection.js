@@ -6,7 +6,7 @@ import { Badge } from "@/components/ui/badge";
 import axios from "axios";
 import { API } from "../../App";
 import { toast } from "sonner";
-import { toAssetUrl } from "@/lib/assets";
+import { toAssetUrl, toSrcSet, toPlaceholderStyle } from "@/lib/assets";
 
 export default function ProductsSection({ onAddToCart }) {
   const [products, setProducts] = useState([]);
@@ -16,13 +16,13 @@ export default function ProductsSection({ onAddToCart }) {
 
   useEffect(() => {
     fetchProducts();
-    fetchCategories();
   }, []);
 
   const fetchProducts = async () => {
     try {
-      const res = await axios.get(`${API}/products`);
-      setProducts(res.data);
+      const res = await axios.get(`${API}/products`, { params: { include_facets: true } });
+      setProducts(res.data.items);
+      setCategories(["All", ...res.data.facets.map((facet) => facet.name)]);
     } catch (error) {
       console.error("Failed to fetch products:", error);
     } finally {
@@ -30,15 +30,6 @@ export default function ProductsSection({ onAddToCart }) {
     }
   };
 
-  const fetchCategories = async () => {
-    try {
-      const res = await axios.get(`${API}/categories`);
-      setCategories(res.data.categories);
-    } catch (error) {
-      console.error("Failed to fetch categories:", error);
-    }
-  };
-
   const filteredProducts = activeCategory === "All"
     ? products
     : products.filter(p => p.category === activeCategory);
@@ -138,9 +129,16 @@ function ProductCard({ product, onAddToCart }) {
   return (
     <div className="group bg-white rounded-2xl overflow-hidden shadow-sm hover:shadow-xl transition-all duration-300 border border-stone-100 hover:border-green-200" data-testid={`product-card-${product.id}`}>
       {/* Image Container */}
-      <div className="relative overflow-hidden aspect-square bg-gradient-to-br from-green-50 to-amber-50">
+      <div
+        className="relative overflow-hidden aspect-square bg-gradient-to-br from-green-50 to-amber-50"
+        style={toPlaceholderStyle(product.image_meta)}
+      >
         <img
           src={toAssetUrl(product.image)}
+          srcSet={toSrcSet(product.image_srcset?.webp)}
+          sizes="(min-width: 1024px) 25vw, (min-width: 640px) 50vw, 100vw"
+          width={product.image_meta?.width}
+          height={product.image_meta?.height}
           alt={product.name}
           className="w-full h-full object-cover group-hover:scale-105 transition-transform duration-500"
         />
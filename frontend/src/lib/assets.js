@@ -21,3 +21,25 @@ export function toAssetUrl(source) {
   const normalized = source.startsWith("/") ? source : `/${source}`;
   return `${BACKEND_ROOT}${normalized}`;
 }
+
+// Builds an <img srcSet> value from a {width: url} map such as product.image_srcset.webp.
+export function toSrcSet(widthMap) {
+  if (!widthMap) return undefined;
+  const entries = Object.entries(widthMap);
+  if (entries.length === 0) return undefined;
+  return entries
+    .sort(([a], [b]) => Number(a) - Number(b))
+    .map(([width, url]) => `${toAssetUrl(url)} ${width}w`)
+    .join(", ");
+}
+
+// Paints product.image_meta's blurred placeholder and colour behind an image while it loads.
+export function toPlaceholderStyle(meta) {
+  if (!meta) return undefined;
+  return {
+    backgroundColor: meta.dominant_color,
+    backgroundImage: meta.placeholder ? `url(${meta.placeholder})` : undefined,
+    backgroundSize: "cover",
+    backgroundPosition: "center",
+  };
+}
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
 import { useNavigate } from "react-router-dom";
 import { ArrowLeft, CheckCircle, Tag, CreditCard, MessageCircle } from "lucide-react";
 import { Button } from "@/components/ui/button";
@@ -27,6 +27,9 @@ export default function CheckoutPage() {
   const [loading, setLoading] = useState(false);
   const [orderSuccess, setOrderSuccess] = useState(false);
   const [orderId, setOrderId] = useState("");
+  // One Idempotency-Key per distinct order, so a double submit or a retried
+  // request replays the first order instead of creating another one.
+  const checkoutAttempt = useRef({ payload: null, key: null });
   const [couponCode, setCouponCode] = useState("");
   const [couponDiscount, setCouponDiscount] = useState(0);
   const [appliedCoupon, setAppliedCoupon] = useState(null);
@@ -144,8 +147,16 @@ export default function CheckoutPage() {
         coupon_code: appliedCoupon?.code
       };
 
+      const payload = JSON.stringify(orderData);
+      if (checkoutAttempt.current.payload !== payload) {
+        checkoutAttempt.current = { payload, key: crypto.randomUUID() };
+      }
+
       const res = await axios.post(`${API}/orders/create`, orderData, {
-        headers: { Authorization: `Bearer ${token}` }
+        headers: {
+          Authorization: `Bearer ${token}`,
+          "Idempotency-Key": checkoutAttempt.current.key
+        }
       });
 
       const order = res.data;
@@ -166,8 +177,12 @@ export default function CheckoutPage() {
               razorpay_payment_id: response.razorpay_payment_id,
               razorpay_signature: response.razorpay_signature
             }, {
-              headers: { Authorization: `Bearer ${token}` }
+              headers: {
+                Authorization: `Bearer ${token}`,
+                "Idempotency-Key": response.razorpay_payment_id
+              }
             });
+            checkoutAttempt.current = { payload: null, key: null };
             setOrderSuccess(true);
             clearCart();
             toast.success("Payment successful! Order placed.");
@@ -182,6 +197,16 @@ export default function CheckoutPage() {
         },
         theme: {
           color: "#15803d"
+        },
+        modal: {
+          // Closing the window without paying frees the stock held for this order.
+          ondismiss: () => {
+            // The cancelled order must not be replayed if the customer tries again.
+            checkoutAttempt.current = { payload: null, key: null };
+            axios.post(`${API}/orders/${order.id}/cancel`, null, {
+              headers: { Authorization: `Bearer ${token}` }
+            }).catch(() => {});
+          }
         }
       };
 
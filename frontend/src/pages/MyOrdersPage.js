@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from "react";
 import { Link } from "react-router-dom";
-import { ArrowLeft, Package, Truck, CheckCircle, Clock, XCircle } from "lucide-react";
+import { ArrowLeft, Package, Truck, CheckCircle, Clock, XCircle, ChevronDown, ChevronUp } from "lucide-react";
 import { Badge } from "@/components/ui/badge";
 import axios from "axios";
 import { API, useCart } from "../App";
@@ -15,6 +15,8 @@ const statusIcons = {
   cancelled: XCircle
 };
 
+const ORDERS_PAGE_SIZE = 20;
+
 const statusColors = {
   pending: "bg-amber-100 text-amber-700",
   confirmed: "bg-blue-100 text-blue-700",
@@ -25,24 +27,51 @@ const statusColors = {
 
 export default function MyOrdersPage() {
   const [orders, setOrders] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
+  // The list holds order summaries; address and shipping details load on demand.
+  const [details, setDetails] = useState({});
+  const [expandedId, setExpandedId] = useState(null);
   const { cartCount } = useCart();
 
   useEffect(() => {
     fetchOrders();
   }, []);
 
-  const fetchOrders = async () => {
+  const fetchOrders = async (cursor = null) => {
+    if (cursor) setLoadingMore(true);
     try {
       const token = localStorage.getItem("token");
       const res = await axios.get(`${API}/orders/my-orders`, {
-        headers: { Authorization: `Bearer ${token}` }
+        headers: { Authorization: `Bearer ${token}` },
+        params: { limit: ORDERS_PAGE_SIZE, ...(cursor && { cursor }) }
       });
-      setOrders(res.data);
+      setOrders(prev => (cursor ? [...prev, ...res.data.items] : res.data.items));
+      setNextCursor(res.data.next_cursor);
     } catch (error) {
       console.error("Failed to fetch orders:", error);
     } finally {
       setLoading(false);
+      setLoadingMore(false);
+    }
+  };
+
+  const toggleDetails = async (orderId) => {
+    if (expandedId === orderId) {
+      setExpandedId(null);
+      return;
+    }
+    setExpandedId(orderId);
+    if (details[orderId]) return;
+    try {
+      const token = localStorage.getItem("token");
+      const res = await axios.get(`${API}/orders/${orderId}`, {
+        headers: { Authorization: `Bearer ${token}` }
+      });
+      setDetails(prev => ({ ...prev, [orderId]: res.data }));
+    } catch (error) {
+      console.error("Failed to fetch order details:", error);
     }
   };
 
@@ -80,6 +109,7 @@ export default function MyOrdersPage() {
             <div className="space-y-6">
               {orders.map((order) => {
                 const StatusIcon = statusIcons[order.order_status] || Clock;
+                const detail = expandedId === order.id ? details[order.id] : null;
                 return (
                   <div
                     key={order.id}
@@ -119,27 +149,44 @@ export default function MyOrdersPage() {
                       </div>
                     </div>
 
-                    <div className="border-t border-stone-100 pt-4 mt-4">
-                      <h4 className="font-semibold text-stone-700 mb-2">Delivery Address</h4>
-                      <p className="text-sm text-stone-600">
-                        {order.address.name}<br />
-                        {order.address.address}<br />
-                        {order.address.city}, {order.address.state} - {order.address.pincode}<br />
-                        Phone: {order.address.phone}
-                      </p>
-                    </div>
+                    {detail && (
+                      <>
+                        <div className="border-t border-stone-100 pt-4 mt-4">
+                          <h4 className="font-semibold text-stone-700 mb-2">Delivery Address</h4>
+                          <p className="text-sm text-stone-600">
+                            {detail.address.name}<br />
+                            {detail.address.address}<br />
+                            {detail.address.city}, {detail.address.state} - {detail.address.pincode}<br />
+                            Phone: {detail.address.phone}
+                          </p>
+                        </div>
 
-                    {(order.courier_name || order.tracking_id) && (
-                      <div className="border-t border-stone-100 pt-4 mt-4">
-                        <h4 className="font-semibold text-stone-700 mb-2">Shipping Details</h4>
-                        <p className="text-sm text-stone-600">
-                          {order.courier_name && <>Courier: {order.courier_name}<br /></>}
-                          {order.tracking_id && <>Tracking ID: <span className="font-mono">{order.tracking_id}</span><br /></>}
-                          {order.shipped_at && <>Shipped On: {new Date(order.shipped_at).toLocaleString()}</>}
-                        </p>
-                      </div>
+                        {(detail.courier_name || detail.tracking_id) && (
+                          <div className="border-t border-stone-100 pt-4 mt-4">
+                            <h4 className="font-semibold text-stone-700 mb-2">Shipping Details</h4>
+                            <p className="text-sm text-stone-600">
+                              {detail.courier_name && <>Courier: {detail.courier_name}<br /></>}
+                              {detail.tracking_id && <>Tracking ID: <span className="font-mono">{detail.tracking_id}</span><br /></>}
+                              {detail.shipped_at && <>Shipped On: {new Date(detail.shipped_at).toLocaleString()}</>}
+                            </p>
+                          </div>
+                        )}
+                      </>
                     )}
 
+                    <button
+                      type="button"
+                      onClick={() => toggleDetails(order.id)}
+                      className="mt-4 inline-flex items-center gap-1 text-sm font-medium text-green-700 hover:text-green-800"
+                      data-testid={`order-details-toggle-${order.id}`}
+                    >
+                      {expandedId === order.id ? (
+                        <>Hide details <ChevronUp className="w-4 h-4" /></>
+                      ) : (
+                        <>Delivery & shipping details <ChevronDown className="w-4 h-4" /></>
+                      )}
+                    </button>
+
                     {order.payment_status === "paid" && (
                       <div className="mt-4 flex items-center gap-2 text-green-600 text-sm">
                         <CheckCircle className="w-4 h-4" />
@@ -149,6 +196,19 @@ export default function MyOrdersPage() {
                   </div>
                 );
               })}
+
+              {nextCursor && (
+                <div className="flex justify-center">
+                  <Button
+                    onClick={() => fetchOrders(nextCursor)}
+                    disabled={loadingMore}
+                    className="border border-green-700 text-green-700 hover:bg-green-50 rounded-full px-8 py-2"
+                    data-testid="load-more-orders"
+                  >
+                    {loadingMore ? "Loading..." : "Load older orders"}
+                  </Button>
+                </div>
+              )}
             </div>
           )}
         </div>
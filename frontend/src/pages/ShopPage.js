@@ -10,7 +10,7 @@ import Navbar from "../components/landing/Navbar";
 import Footer from "../components/landing/Footer";
 import CartSidebar from "../components/landing/CartSidebar";
 import { toast } from "sonner";
-import { toAssetUrl } from "@/lib/assets";
+import { toAssetUrl, toSrcSet, toPlaceholderStyle } from "@/lib/assets";
 import {
   Select,
   SelectContent,
@@ -32,7 +32,6 @@ export default function ShopPage() {
 
   useEffect(() => {
     fetchProducts();
-    fetchCategories();
   }, []);
 
   useEffect(() => {
@@ -41,8 +40,9 @@ export default function ShopPage() {
 
   const fetchProducts = async () => {
     try {
-      const res = await axios.get(`${API}/products`);
-      setProducts(res.data);
+      const res = await axios.get(`${API}/products`, { params: { include_facets: true } });
+      setProducts(res.data.items);
+      setCategories(["All", ...res.data.facets.map((facet) => facet.name)]);
     } catch (error) {
       console.error("Failed to fetch products:", error);
     } finally {
@@ -50,15 +50,6 @@ export default function ShopPage() {
     }
   };
 
-  const fetchCategories = async () => {
-    try {
-      const res = await axios.get(`${API}/categories`);
-      setCategories(res.data.categories);
-    } catch (error) {
-      console.error("Failed to fetch categories:", error);
-    }
-  };
-
   const filteredProducts = products
     .filter(p => activeCategory === "All" || p.category === activeCategory)
     .filter(p => p.name.toLowerCase().includes(searchQuery.toLowerCase()) ||
@@ -187,9 +178,16 @@ function ProductCard({ product, onAddToCart }) {
   return (
     <div className="group bg-white rounded-2xl overflow-hidden shadow-sm hover:shadow-xl transition-all duration-300 border border-stone-100 hover:border-green-200">
       {/* Image Container */}
-      <div className="relative overflow-hidden aspect-square bg-gradient-to-br from-green-50 to-amber-50">
+      <div
+        className="relative overflow-hidden aspect-square bg-gradient-to-br from-green-50 to-amber-50"
+        style={toPlaceholderStyle(product.image_meta)}
+      >
         <img
           src={toAssetUrl(product.image)}
+          srcSet={toSrcSet(product.image_srcset?.webp)}
+          sizes="(min-width: 1024px) 25vw, (min-width: 640px) 50vw, 100vw"
+          width={product.image_meta?.width}
+          height={product.image_meta?.height}
           alt={product.name}
           className="w-full h-full object-cover group-hover:scale-105 transition-transform duration-500"
         />